@@ -0,0 +1,414 @@
+"""Benchmark of a full resource_collector.handler() run against synthetic estates, without AWS access.
+Every estate spreads its resources evenly over all resource types the decorators table supports and two regions.
+API calls are answered by replay_harness from the estate, optionally with latency and throttling.
+Reports wall time, API calls per operation and peak RSS per estate size.
+
+Run from the 'data' directory: python benchmark_collector.py [sizes] [latency seconds] [throttle rate] [results file]
+for example python benchmark_collector.py 100,1000,10000 0.01 0.001
+The results are written as JSON to the results file, by default benchmark_collector.json in the temp directory.
+"""
+import contextlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import replay_harness
+import resource_collector
+
+account_id = '123456789012'
+estate_regions = ['eu-west-1', 'us-east-1']
+estate_tag_key = 'iem'
+estate_tag_value = 'benchmark'
+
+# ARN of the n-th resource of every synthetic resource type, in a region
+resource_types = {
+    'apigateway-rest': lambda region, n: f'arn:aws:apigateway:{region}::/restapis/rest{n}',
+    'apigateway-http': lambda region, n: f'arn:aws:apigateway:{region}::/apis/http{n}',
+    'appsync': lambda region, n: f'arn:aws:appsync:{region}:{account_id}:apis/graphql{n}',
+    'aurora': lambda region, n: f'arn:aws:rds:{region}:{account_id}:cluster:aurora-{n}',
+    'rds': lambda region, n: f'arn:aws:rds:{region}:{account_id}:db:database-{n}',
+    'autoscaling': lambda region, n: f'arn:aws:autoscaling:{region}:{account_id}:autoScalingGroup:'
+                                     f'{n:08d}-0000-0000-0000-000000000000:autoScalingGroupName/asg-{n}',
+    'odcr': lambda region, n: f'arn:aws:ec2:{region}:{account_id}:capacity-reservation/cr-{n:017x}',
+    'dynamodb': lambda region, n: f'arn:aws:dynamodb:{region}:{account_id}:table/table-{n}',
+    'ec2': lambda region, n: f'arn:aws:ec2:{region}:{account_id}:instance/i-{n:017x}',
+    'lambda': lambda region, n: f'arn:aws:lambda:{region}:{account_id}:function:function-{n}',
+    'elb': lambda region, n: f'arn:aws:elasticloadbalancing:{region}:{account_id}:loadbalancer/classic-{n}',
+    'alb': lambda region, n: f'arn:aws:elasticloadbalancing:{region}:{account_id}:loadbalancer/app/alb-{n}/{n:016x}',
+    'nlb': lambda region, n: f'arn:aws:elasticloadbalancing:{region}:{account_id}:loadbalancer/net/nlb-{n}/{n:016x}',
+    'ecs': lambda region, n: f'arn:aws:ecs:{region}:{account_id}:cluster/cluster-{n}',
+    'natgw': lambda region, n: f'arn:aws:ec2:{region}:{account_id}:natgateway/nat-{n:017x}',
+    'tgw': lambda region, n: f'arn:aws:ec2:{region}:{account_id}:transit-gateway/tgw-{n:017x}',
+    'sqs': lambda region, n: f'arn:aws:sqs:{region}:{account_id}:queue-{n}',
+    's3': lambda region, n: f'arn:aws:s3:::bucket-{region}-{n}',
+    'sns': lambda region, n: f'arn:aws:sns:{region}:{account_id}:topic-{n}',
+    'cloudfront': lambda region, n: f'arn:aws:cloudfront::{account_id}:distribution/E{n:013d}',
+    'elasticache': lambda region, n: f'arn:aws:elasticache:{region}:{account_id}:cluster:redis-{n // 3}-{n % 3:03d}',
+    'mediapackage': lambda region, n: f'arn:aws:mediapackage:{region}:{account_id}:channels/{n:032x}',
+    'medialive': lambda region, n: f'arn:aws:medialive:{region}:{account_id}:channel:{n}',
+    'efs': lambda region, n: f'arn:aws:elasticfilesystem:{region}:{account_id}:file-system/fs-{n:017x}',
+    'beanstalk': lambda region, n: f'arn:aws:elasticbeanstalk:{region}:{account_id}:environment/app/env-{n}',
+    'network-firewall': lambda region, n: f'arn:aws:network-firewall:{region}:{account_id}:firewall/firewall-{n}',
+    'directconnect': lambda region, n: f'arn:aws:directconnect:{region}:{account_id}:dxvif/dxvif-{n:08x}',
+    'networkmonitor': lambda region, n: f'arn:aws:networkmonitor:{region}:{account_id}:monitor/monitor-{n}'
+}
+
+
+def synthetic_estate(size):
+    """ARNs of 'size' resources per region and resource type, round robin over types and regions
+    """
+    estate = {region: {resource_type: [] for resource_type in resource_types} for region in estate_regions}
+    types = list(resource_types)
+    for index in range(size):
+        region = estate_regions[index % len(estate_regions)]
+        resource_type = types[(index // len(estate_regions)) % len(types)]
+        estate[region][resource_type].append(resource_types[resource_type](region, index))
+    return estate
+
+
+def last(arn, separator='/'):
+    return arn.split(separator)[-1]
+
+
+def page(items, params, size_param, token_param, default_size, next_token_param=None):
+    """Slice of a listing for the pagination parameters of the call, and the token of the next page
+    """
+    size = params.get(size_param) or default_size
+    start = int(params.get(token_param) or 0)
+    token = str(start + size) if start + size < len(items) else None
+    return items[start:start + size], {next_token_param or token_param: token} if token else {}
+
+
+def filter_values(params, name):
+    for request_filter in params.get('Filters', []):
+        if request_filter['Name'] == name:
+            return request_filter['Values']
+    return []
+
+
+def estate_responder(estate):
+    """respond(operation, region, params) answering every call the collector makes for the estate
+    """
+    tags = [{'Key': estate_tag_key, 'Value': estate_tag_value}]
+
+    def of(region, resource_type):
+        return estate.get(region, {}).get(resource_type, [])
+
+    def described_instance(instance_id, n):
+        return {'InstanceId': instance_id, 'InstanceType': 't3.micro' if n % 2 else 'm5.large',
+                'State': {'Name': 'running'}, 'Tags': tags}
+
+    def get_resources(region, params):
+        arns = [arn for resource_type, arns in estate.get(region, {}).items() if resource_type != 'autoscaling'
+                for arn in arns]
+        # The tagging API of every region returns the global resources
+        if region != estate_regions[0]:
+            arns += of(estate_regions[0], 's3') + of(estate_regions[0], 'cloudfront')
+        items, token = page(arns, params, 'ResourcesPerPage', 'PaginationToken', 50)
+        return dict({'ResourceTagMappingList': [{'ResourceARN': arn, 'Tags': tags} for arn in items]}, **token)
+
+    def describe_auto_scaling_groups(region, params):
+        items, token = page(of(region, 'autoscaling'), params, 'MaxRecords', 'NextToken', 50)
+        return dict({'AutoScalingGroups': [{'AutoScalingGroupARN': arn, 'AutoScalingGroupName': last(arn),
+                                            'Tags': tags} for arn in items]}, **token)
+
+    def list_metrics(region, params):
+        metrics = [{'Namespace': 'Benchmark/Application', 'MetricName': 'Requests', 'Dimensions': []}]
+        metrics += [{'Namespace': 'CWAgent', 'MetricName': 'mem_used_percent',
+                     'Dimensions': [{'Name': 'InstanceId', 'Value': last(arn)}]} for arn in of(region, 'ec2')[::2]]
+        metrics += [{'Namespace': 'AWS/NetworkFirewall', 'MetricName': 'Packets',
+                     'Dimensions': [{'Name': 'FirewallName', 'Value': last(arn)}]}
+                    for arn in of(region, 'network-firewall')]
+        if params.get('Namespace'):
+            metrics = [metric for metric in metrics if metric['Namespace'] == params['Namespace']]
+        items, token = page(metrics, params, None, 'NextToken', 500)
+        return dict({'Metrics': items}, **token)
+
+    def describe_db_clusters(region, params):
+        clusters = [{'DBClusterIdentifier': last(arn, ':'), 'MultiAZ': True, 'Engine': 'aurora-mysql',
+                     'EngineMode': 'provisioned', 'EngineVersion': '8.0',
+                     'DBClusterMembers': [{'DBInstanceIdentifier': f'{last(arn, ":")}-1', 'IsClusterWriter': True}],
+                     'Endpoint': f'{last(arn, ":")}.cluster', 'ReaderEndpoint': f'{last(arn, ":")}.cluster-ro',
+                     'ReadReplicaIdentifiers': [], 'StorageType': 'aurora', 'PerformanceInsightsEnabled': False}
+                    for arn in of(region, 'aurora')]
+        if params.get('DBClusterIdentifier'):
+            clusters = [cluster for cluster in clusters
+                        if cluster['DBClusterIdentifier'] == params['DBClusterIdentifier']]
+        items, token = page(clusters, params, 'MaxRecords', 'Marker', 100)
+        return dict({'DBClusters': items}, **token)
+
+    def describe_db_instances(region, params):
+        instances = [{'DBInstanceIdentifier': last(arn, ':'), 'MultiAZ': False, 'Engine': 'postgres',
+                      'EngineVersion': '16.1', 'DBInstanceClass': 'db.m6g.large', 'StorageType': 'gp3',
+                      'Endpoint': {'Address': f'{last(arn, ":")}.rds', 'Port': 5432},
+                      'PerformanceInsightsEnabled': False} for arn in of(region, 'rds')]
+        if params.get('DBInstanceIdentifier'):
+            instances = [instance for instance in instances
+                         if instance['DBInstanceIdentifier'] == params['DBInstanceIdentifier']]
+        items, token = page(instances, params, 'MaxRecords', 'Marker', 100)
+        return dict({'DBInstances': items}, **token)
+
+    def describe_instances(region, params):
+        instance_ids = set(filter_values(params, 'instance-id'))
+        instances = [described_instance(last(arn), n) for n, arn in enumerate(of(region, 'ec2'))
+                     if last(arn) in instance_ids]
+        return {'Reservations': [{'Instances': instances}] if instances else []}
+
+    def describe_volumes(region, params):
+        return {'Volumes': [{'VolumeId': f'vol-{instance_id[2:]}', 'Size': 8,
+                             'Attachments': [{'InstanceId': instance_id}]}
+                            for instance_id in filter_values(params, 'attachment.instance-id')]}
+
+    def describe_instance_credit_specifications(region, params):
+        return {'InstanceCreditSpecifications': [{'InstanceId': instance_id, 'CpuCredits': 'standard'}
+                                                 for instance_id in params['InstanceIds']]}
+
+    def describe_transit_gateway_attachments(region, params):
+        return {'TransitGatewayAttachments': [
+            {'TransitGatewayId': tgw_id, 'TransitGatewayAttachmentId': f'tgw-attach-{tgw_id[4:]}{n}',
+             'ResourceType': 'vpc', 'State': 'available', 'Association': {'State': 'associated'}}
+            for tgw_id in filter_values(params, 'transit-gateway-id') for n in range(2)]}
+
+    def describe_vpc_endpoints(region, params):
+        return {'VpcEndpoints': [{'VpcEndpointId': endpoint_id, 'ServiceName': 'com.amazonaws.vpce.firewall',
+                                  'Tags': [{'Key': 'Name', 'Value': endpoint_id}]}
+                                 for endpoint_id in filter_values(params, 'vpc-endpoint-id')]}
+
+    def describe_cache_clusters(region, params):
+        clusters = [{'CacheClusterId': last(arn, ':'), 'Engine': 'redis',
+                     'ReplicationGroupId': last(arn, ':').rsplit('-', 1)[0]} for arn in of(region, 'elasticache')]
+        if params.get('CacheClusterId'):
+            clusters = [cluster for cluster in clusters if cluster['CacheClusterId'] == params['CacheClusterId']]
+        items, token = page(clusters, params, 'MaxRecords', 'Marker', 100)
+        return dict({'CacheClusters': items}, **token)
+
+    def describe_replication_groups(region, params):
+        group_ids = list(dict.fromkeys(last(arn, ':').rsplit('-', 1)[0] for arn in of(region, 'elasticache')))
+        if params.get('ReplicationGroupId'):
+            group_ids = [group_id for group_id in group_ids if group_id == params['ReplicationGroupId']]
+        items, token = page(group_ids, params, 'MaxRecords', 'Marker', 100)
+        return dict({'ReplicationGroups': [{'ReplicationGroupId': group_id, 'Status': 'available'}
+                                           for group_id in items]}, **token)
+
+    def function_configuration(arn):
+        return {'FunctionName': last(arn, ':'), 'FunctionArn': arn, 'Runtime': 'python3.12', 'MemorySize': 128}
+
+    def list_functions(region, params):
+        items, token = page(of(region, 'lambda'), params, 'MaxItems', 'Marker', 50, 'NextMarker')
+        return dict({'Functions': [function_configuration(arn) for arn in items]}, **token)
+
+    def elbv2_load_balancers(region):
+        return of(region, 'alb') + of(region, 'nlb')
+
+    def describe_target_groups(region, params):
+        target_groups = [{'TargetGroupArn': f'{arn.replace(":loadbalancer/", ":targetgroup/")}-tg',
+                          'LoadBalancerArns': [arn]} for arn in elbv2_load_balancers(region)]
+        if params.get('LoadBalancerArn'):
+            target_groups = [target_group for target_group in target_groups
+                             if params['LoadBalancerArn'] in target_group['LoadBalancerArns']]
+        items, token = page(target_groups, params, 'PageSize', 'Marker', 400, 'NextMarker')
+        return dict({'TargetGroups': items}, **token)
+
+    def describe_firewall(region, params):
+        name = last(params['FirewallArn'])
+        return {'Firewall': {'FirewallName': name, 'FirewallArn': params['FirewallArn'], 'VpcId': 'vpc-1'},
+                'FirewallStatus': {'Status': 'READY', 'ConfigurationSyncStateSummary': 'IN_SYNC', 'SyncStates': {
+                    f'{region}{zone}': {'Attachment': {'EndpointId': f'vpce-{name}-{zone}', 'Status': 'READY'}}
+                    for zone in 'ab'}}}
+
+    def describe_virtual_interfaces(region, params):
+        vifs = [{'virtualInterfaceId': last(arn), 'connectionId': f'dxcon-{n // 4:08x}', 'region': region,
+                 'ownerAccount': account_id} for n, arn in enumerate(of(region, 'directconnect'))]
+        if params.get('virtualInterfaceId'):
+            vifs = [vif for vif in vifs if vif['virtualInterfaceId'] == params['virtualInterfaceId']]
+        return {'virtualInterfaces': vifs}
+
+    def describe_connections(region, params):
+        connection_ids = {f'dxcon-{n // 4:08x}' for n in range(len(of(region, 'directconnect')))}
+        if params.get('connectionId'):
+            connection_ids &= {params['connectionId']}
+        return {'connections': [{'connectionId': connection_id, 'connectionState': 'available', 'region': region}
+                                for connection_id in sorted(connection_ids)]}
+
+    operations = {
+        'resourcegroupstaggingapi.GetResources': get_resources,
+        'autoscaling.DescribeAutoScalingGroups': describe_auto_scaling_groups,
+        'cloudwatch.ListMetrics': list_metrics,
+        'apigateway.GetRestApi': lambda region, params: {
+            'name': params['restApiId'], 'endpointConfiguration': {'types': ['REGIONAL']},
+            'disableExecuteApiEndpoint': False},
+        'apigateway.GetStages': lambda region, params: {'item': [{'stageName': 'prod'}]},
+        'apigatewayv2.GetApi': lambda region, params: {
+            'Name': params['ApiId'], 'ApiId': params['ApiId'], 'ProtocolType': 'HTTP',
+            'DisableExecuteApiEndpoint': False, 'ApiEndpoint': f'https://{params["ApiId"]}.execute-api'},
+        'appsync.GetGraphqlApi': lambda region, params: {'graphqlApi': {
+            'name': params['apiId'], 'apiId': params['apiId'], 'xrayEnabled': False,
+            'uris': {'REALTIME': f'wss://{params["apiId"]}', 'GRAPHQL': f'https://{params["apiId"]}'}}},
+        'rds.DescribeDBClusters': describe_db_clusters,
+        'rds.DescribeDBInstances': describe_db_instances,
+        'cloudfront.GetDistribution': lambda region, params: {'Distribution': {
+            'Id': params['Id'], 'ARN': f'arn:aws:cloudfront::{account_id}:distribution/{params["Id"]}',
+            'DomainName': f'{params["Id"].lower()}.cloudfront.net',
+            'DistributionConfig': {'Aliases': {'Quantity': 0}, 'Origins': {'Quantity': 1, 'Items': []}}}},
+        'mediapackage.ListChannels': lambda region, params: {'Channels': [
+            {'Arn': arn, 'Id': last(arn), 'HlsIngest': {'IngestEndpoints': [{'Id': f'{last(arn)}-ingest'}]}}
+            for arn in of(region, 'mediapackage')]},
+        'mediapackage.ListOriginEndpoints': lambda region, params: {
+            'OriginEndpoints': [{'Id': f'{params["ChannelId"]}-origin'}]},
+        'medialive.ListChannels': lambda region, params: {'Channels': [
+            {'Arn': arn, 'Id': last(arn, ':')} for arn in of(region, 'medialive')]},
+        'medialive.DescribeChannel': lambda region, params: {'PipelineDetails': [{'PipelineId': '0'}]},
+        'networkmonitor.GetMonitor': lambda region, params: {
+            'monitorName': params['monitorName'], 'state': 'ACTIVE', 'aggregationPeriod': 60},
+        'dynamodb.DescribeTable': lambda region, params: {'Table': {
+            'TableName': params['TableName'],
+            'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}}},
+        'efs.DescribeFileSystems': lambda region, params: dict(zip(('FileSystems', 'NextMarker'), (lambda items, token: (
+            [{'FileSystemId': last(arn), 'ThroughputMode': 'bursting'} for arn in items],
+            token.get('Marker')))(*page(of(region, 'efs'), params, 'MaxItems', 'Marker', 100)))),
+        'ec2.DescribeInstances': describe_instances,
+        'ec2.DescribeVolumes': describe_volumes,
+        'ec2.DescribeInstanceCreditSpecifications': describe_instance_credit_specifications,
+        'ec2.DescribeTransitGatewayAttachments': describe_transit_gateway_attachments,
+        'ec2.DescribeVpcEndpoints': describe_vpc_endpoints,
+        'elasticache.DescribeCacheClusters': describe_cache_clusters,
+        'elasticache.DescribeReplicationGroups': describe_replication_groups,
+        'lambda.GetAccountSettings': lambda region, params: {
+            'AccountUsage': {'FunctionCount': len(of(region, 'lambda'))}},
+        'lambda.ListFunctions': list_functions,
+        'lambda.GetFunctionConfiguration': lambda region, params: function_configuration(
+            resource_types['lambda'](region, 0).replace('function-0', params['FunctionName'])),
+        'elb.DescribeLoadBalancers': lambda region, params: {'LoadBalancerDescriptions': [
+            {'LoadBalancerName': name, 'DNSName': f'{name}.elb'} for name in params['LoadBalancerNames']]},
+        'elbv2.DescribeLoadBalancers': lambda region, params: {'LoadBalancers': [
+            {'LoadBalancerArn': arn, 'Type': 'application' if '/app/' in arn else 'network'}
+            for arn in params['LoadBalancerArns']]},
+        'elbv2.DescribeTargetGroups': describe_target_groups,
+        'elbv2.DescribeTargetHealth': lambda region, params: {'TargetHealthDescriptions': [
+            {'Target': {'Id': f'i-{n:017x}'}} for n in range(2)]},
+        'ecs.DescribeClusters': lambda region, params: {'clusters': [
+            {'clusterArn': arn, 'clusterName': last(arn)} for arn in params['clusters']]},
+        'ecs.ListServices': lambda region, params: {'serviceArns': [
+            f'{params["cluster"].replace(":cluster/", ":service/")}/service-{n}' for n in range(3)]},
+        'ecs.DescribeServices': lambda region, params: {'services': [
+            {'serviceArn': arn, 'launchType': 'EC2', 'events': [{'message': 'steady state'}],
+             'loadBalancers': [{'targetGroupArn': f'{params["cluster"]}-tg'}]} for arn in params['services']]},
+        'network-firewall.DescribeFirewall': describe_firewall,
+        'network-firewall.DescribeLoggingConfiguration': lambda region, params: {
+            'FirewallArn': params['FirewallArn'], 'LoggingConfiguration': {'LogDestinationConfigs': []}},
+        's3.GetBucketEncryption': lambda region, params: {'ServerSideEncryptionConfiguration': {'Rules': [
+            {'ApplyServerSideEncryptionByDefault': {'SSEAlgorithm': 'AES256'}, 'BucketKeyEnabled': False}]}},
+        's3.GetBucketLocation': lambda region, params: {'LocationConstraint': params['Bucket'].split('-', 1)[1]
+                                                        .rsplit('-', 1)[0].replace('us-east-1', '') or None},
+        'sqs.GetQueueAttributes': lambda region, params: {'Attributes': {
+            name: 'false' if name == 'FifoQueue' else '262144' for name in params['AttributeNames']}},
+        'sqs.GetQueueUrl': lambda region, params: {
+            'QueueUrl': f'https://sqs.{region}.amazonaws.com/{account_id}/{params["QueueName"]}'},
+        'directconnect.DescribeVirtualInterfaces': describe_virtual_interfaces,
+        'directconnect.DescribeConnections': describe_connections
+    }
+
+    def respond(operation, region, params):
+        answer = operations.get(operation)
+        if answer is None:
+            return 400, {'Error': {'Code': 'UnsupportedOperation', 'Message': f'{operation} is not synthesized'}}
+        return 200, answer(region, params)
+
+    return respond
+
+
+def benchmark_config(work_dir):
+    """The project configuration with the estate tags and regions, writing into work_dir without caches
+    """
+    try:
+        with open("../lib/config.json", "r", encoding="utf-8") as f:
+            main_config = json.load(f)
+    finally:
+        f.close()
+    main_config.update({
+        'ResourceFile': os.path.join(work_dir, 'resources.json'),
+        'CustomNamespaceFile': os.path.join(work_dir, 'custom_namespaces.json'),
+        'TagKey': estate_tag_key,
+        'TagValues': [estate_tag_value],
+        'Regions': list(estate_regions)
+    })
+    collector = main_config.setdefault('Collector', {})
+    collector['decorationCache'] = {'enabled': False}
+    collector['customNamespaces'] = dict(collector.get('customNamespaces', {}), cacheFile='')
+    collector['accounts'] = {'enabled': False}
+    collector['report'] = dict(collector.get('report', {}), file=os.path.join(work_dir, 'collection_report.json'))
+    config_file = os.path.join(work_dir, 'config.json')
+    try:
+        with open(config_file, "w", encoding="utf-8") as f:
+            f.write(json.dumps(main_config))
+    finally:
+        f.close()
+    return config_file
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_estate(size, latency, throttle_rate):
+    """One collection run of a synthetic estate in this process, returns its measurements
+    """
+    replay_harness.start_replay(estate_responder(synthetic_estate(size)), latency, throttle_rate)
+    with tempfile.TemporaryDirectory() as work_dir:
+        config_file = benchmark_config(work_dir)
+        start = time.perf_counter()
+        with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+            resource_collector.handler(config_file)
+        seconds = time.perf_counter() - start
+        with open(os.path.join(work_dir, 'resources.json'), "r", encoding="utf-8") as f:
+            written = len(json.load(f))
+    return {
+        'size': size,
+        'seconds': seconds,
+        'resources': written,
+        'calls': dict(sorted(replay_harness.replay_stats['calls'].items())),
+        'throttles': sum(replay_harness.replay_stats['throttles'].values()),
+        'peakRssMb': peak_rss_mb()
+    }
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--run':
+        # Every estate runs in its own process so module state and peak RSS do not carry over
+        print(json.dumps(run_estate(int(sys.argv[2]), float(sys.argv[3]), float(sys.argv[4]))))
+        return
+
+    sizes = [int(size) for size in sys.argv[1].split(',')] if len(sys.argv) > 1 else [100, 1000, 10000]
+    latency = sys.argv[2] if len(sys.argv) > 2 else '0'
+    throttle_rate = sys.argv[3] if len(sys.argv) > 3 else '0'
+    results_file = sys.argv[4] if len(sys.argv) > 4 else os.path.join(tempfile.gettempdir(), 'benchmark_collector.json')
+    results = []
+    for size in sizes:
+        output = subprocess.run([sys.executable, __file__, '--run', str(size), latency, throttle_rate],
+                                check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        results.append(result)
+        print(f'{size} resources: {result["seconds"]:.2f}s, {sum(result["calls"].values())} API calls, '
+              f'{result["throttles"]} throttled attempts, {result["resources"]} resources written, '
+              f'peak RSS {result["peakRssMb"]:.0f} MB')
+
+    print('API calls per operation:')
+    for operation in sorted({operation for result in results for operation in result['calls']}):
+        counts = ', '.join(f'{result["calls"].get(operation, 0)}' for result in results)
+        print(f'  {operation}: {counts}')
+    try:
+        with open(results_file, "w", encoding="utf-8") as f:
+            f.write(json.dumps(results, indent=4))
+    finally:
+        f.close()
+    print(f'Results written to {results_file}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""Microbenchmark of ARN classification in resource_collector.get_decorator().
+Compares a single pass of the dispatch table against the former chain of substring tests on synthetic ARNs.
+The table is not faster per ARN, it parses every ARN with parse_arn(). What it gains is correct classification
+(ARNs of other services that merely contain a decorated service's name, like an EventBridge rule named
+lambda-function-cleanup, are no longer decorated) and one table entry per resource type instead of an ordered chain.
+
+Run from the 'data' directory: python benchmark_router.py [count]
+"""
+import random
+import sys
+import time
+
+import resource_collector
+
+sample_arns = [
+    'arn:aws:apigateway:eu-west-1::/restapis/a1b2c3d4e5',
+    'arn:aws:apigateway:eu-west-1::/restapis/a1b2c3d4e5/stages/prod',
+    'arn:aws:apigateway:eu-west-1::/apis/f6g7h8i9j0',
+    'arn:aws:appsync:eu-west-1:123456789012:apis/abcdefghijklmnopqrstuvwxyz',
+    'arn:aws:rds:eu-west-1:123456789012:cluster:aurora-cluster-1',
+    'arn:aws:rds:eu-west-1:123456789012:db:database-1',
+    'arn:aws:autoscaling:eu-west-1:123456789012:autoScalingGroup:ed296d0c-a26f-489e-b479-f1cd5c6aa2a8:autoScalingGroupName/TestAuto',
+    'arn:aws:ec2:eu-west-1:123456789012:capacity-reservation/cr-0123456789abcdef0',
+    'arn:aws:dynamodb:eu-west-1:123456789012:table/Orders',
+    'arn:aws:ec2:eu-west-1:123456789012:instance/i-0123456789abcdef0',
+    'arn:aws:ec2:eu-west-1:123456789012:volume/vol-0123456789abcdef0',
+    'arn:aws:lambda:eu-west-1:123456789012:function:OrderHandler',
+    'arn:aws:elasticloadbalancing:eu-west-1:123456789012:loadbalancer/classic-lb',
+    'arn:aws:elasticloadbalancing:eu-west-1:123456789012:loadbalancer/app/my-alb/50dc6c495c0c9188',
+    'arn:aws:elasticloadbalancing:eu-west-1:123456789012:loadbalancer/net/my-nlb/50dc6c495c0c9188',
+    'arn:aws:elasticloadbalancing:eu-west-1:123456789012:targetgroup/my-targets/73e2d6bc24d8a067',
+    'arn:aws:elasticloadbalancing:eu-west-1:123456789012:listener/app/my-alb/50dc6c495c0c9188/f2f7dc8efc522ab2',
+    'arn:aws:ecs:eu-west-1:123456789012:cluster/production',
+    'arn:aws:ec2:eu-west-1:123456789012:natgateway/nat-0123456789abcdef0',
+    'arn:aws:ec2:eu-west-1:123456789012:transit-gateway/tgw-0123456789abcdef0',
+    'arn:aws:sqs:eu-west-1:123456789012:OrderQueue',
+    'arn:aws:s3:::my-bucket',
+    'arn:aws:sns:eu-west-1:123456789012:AlarmTopic',
+    'arn:aws:cloudfront::123456789012:distribution/E2QWRUHAPOMQZL',
+    'arn:aws:elasticache:eu-west-1:123456789012:cluster:redis-0001-001',
+    'arn:aws:mediapackage:eu-west-1:123456789012:channels/abcdef0123456789',
+    'arn:aws:medialive:eu-west-1:123456789012:channel:1234567',
+    'arn:aws:elasticfilesystem:eu-west-1:123456789012:file-system/fs-0123456789abcdef0',
+    'arn:aws:elasticbeanstalk:eu-west-1:123456789012:environment/app/env',
+    'arn:aws:network-firewall:eu-west-1:123456789012:firewall/inspection',
+    'arn:aws:directconnect:eu-west-1:123456789012:dxvif/dxvif-fgabcdef',
+    'arn:aws:networkmonitor:eu-west-1:123456789012:monitor/probe-monitor',
+    'arn:aws:kms:eu-west-1:123456789012:key/1234abcd-12ab-34cd-56ef-1234567890ab',
+    'arn:aws:events:eu-west-1:123456789012:rule/lambda-function-cleanup',
+]
+
+
+def chain_classifier(arn):
+    """The substring chain router() used before the dispatch table, returning the decorator it picked
+    """
+    if ':apigateway:' in arn and '/restapis/' in arn and 'stages' not in arn:
+        return resource_collector.apigw1_decorator
+    elif ':apigateway:' in arn and '/apis/' in arn and 'stages' not in arn:
+        return resource_collector.apigw2_decorator
+    elif ':appsync:' in arn:
+        return resource_collector.appsync_decorator
+    elif ':rds:' in arn and ':cluster:' in arn:
+        return resource_collector.aurora_decorator
+    elif ':autoscaling:' in arn and ':autoScalingGroup:' in arn:
+        return resource_collector.autoscaling_decorator
+    elif ':capacity-reservation/' in arn:
+        return resource_collector.odcr_decorator
+    elif ':dynamodb:' in arn and ':table/' in arn:
+        return resource_collector.dynamodb_decorator
+    elif ':ec2:' in arn and ':instance/' in arn:
+        return resource_collector.ec2_decorator
+    elif 'lambda' in arn and 'function' in arn:
+        return resource_collector.lambda_decorator
+    elif 'elasticloadbalancing' in arn and '/net/' not in arn and '/app/' not in arn and ':targetgroup/' not in arn:
+        return resource_collector.elb1_decorator
+    elif 'elasticloadbalancing' in arn and ('/net/' in arn or '/app/' in arn) and ':targetgroup/' not in arn and ':listener/' not in arn:
+        return resource_collector.elb2_decorator
+    elif ':ecs:' in arn and ':cluster/' in arn:
+        return resource_collector.ecs_decorator
+    elif ':natgateway/' in arn and ':ec2:' in arn:
+        return resource_collector.natgw_decorator
+    elif ':transit-gateway/' in arn and ':ec2:' in arn:
+        return resource_collector.tgw_decorator
+    elif ':sqs:' in arn:
+        return resource_collector.sqs_decorator
+    elif 'arn:aws:s3:' in arn:
+        return resource_collector.s3_decorator
+    elif ':sns:' in arn:
+        return resource_collector.sns_decorator
+    elif ':cloudfront:' in arn and ':distribution/' in arn:
+        return resource_collector.cloudfront_decorator
+    elif ':elasticache:' in arn:
+        return resource_collector.elasticache_decorator
+    elif ':mediapackage:' in arn and ':channels/' in arn:
+        return resource_collector.mediapackage_decorator
+    elif ':medialive:' in arn and ':channel:' in arn:
+        return resource_collector.medialive_decorator
+    elif ':elasticfilesystem:' in arn:
+        return resource_collector.efs_decorator
+    elif 'arn:aws:elasticbeanstalk:' in arn:
+        return resource_collector.beanstalk_decorator
+    elif 'arn:aws:network-firewall:' in arn and ':firewall/' in arn:
+        return resource_collector.network_firewall_decorator
+    elif 'arn:aws:directconnect:' in arn and ':dxvif/' in arn:
+        return resource_collector.direct_connect_handler
+    elif 'arn:aws:networkmonitor:' in arn and ':monitor/' in arn:
+        return resource_collector.network_monitor_decorator
+    # Not part of the former chain, RDS instances were only routed once they had a decorator
+    elif ':rds:' in arn and ':db:' in arn:
+        return resource_collector.rds_decorator
+    return None
+
+
+def time_classifier(classifier, arns, repeats=3):
+    """Best of 'repeats' passes, to filter out scheduling noise
+    """
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for arn in arns:
+            classifier(arn)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    random.seed(42)
+    arns = [f'{random.choice(sample_arns)}{index}' for index in range(count)]
+
+    for arn in sample_arns:
+        chain, table = chain_classifier(arn), resource_collector.get_decorator(arn)
+        if chain is not table:
+            print(f'Misclassified by the chain: {arn} chain={getattr(chain, "__name__", None)} '
+                  f'table={getattr(table, "__name__", None)}')
+
+    # A collection run classifies every resource once, in route_resources()
+    print(f'Classifying {count} synthetic ARNs once')
+    chain_seconds = time_classifier(chain_classifier, arns)
+    table_seconds = time_classifier(resource_collector.get_decorator, arns)
+    print(f'substring chain {chain_seconds:.3f}s, dispatch table {table_seconds:.3f}s, '
+          f'table takes {table_seconds / chain_seconds:.2f}x the time of the chain')
+    print('The dispatch table is not a per-ARN speedup, it is kept for correct classification')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+"""Offline capture and replay of the AWS API calls of resource_collector.
+
+Capture records the region, parameters and parsed response of every call of a live run into a fixture file.
+Replay answers every call from a fixture file, or from any responder function, before it reaches the network.
+A call whose operation, region and parameters were not recorded fails the run, unless --round-robin is given,
+which answers it with the recorded responses of the operation in turn. Such misses are counted and reported.
+Replayed calls can be slowed down by a fixed latency and throttled at a given rate. Responses are injected where the
+HTTP request would be sent, so a throttled attempt is a 400 Throttling response that goes through the retry mode
+of the client, its backoff and adaptive rate limiter, and the call fails once all attempts are throttled, like it would
+against the service. Timestamps of replayed responses are parsed back into datetimes from the output shape.
+
+Run from the 'data' directory:
+  python replay_harness.py capture fixtures.json
+  python replay_harness.py replay fixtures.json [latency seconds] [throttle rate] [--round-robin]
+"""
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from botocore.awsrequest import AWSResponse
+from botocore.utils import parse_timestamp
+
+import resource_collector
+
+replay_stats = {'calls': Counter(), 'throttles': Counter(), 'misses': Counter()}
+replay_stats_lock = threading.Lock()
+# Header replay_send passes the replayed response in, replay_parse turns it back into the parsed response.
+# The body only satisfies the protocol parser and the S3 check for errors in 200 responses
+replay_header = 'x-replay-response'
+
+
+def operation_key(model):
+    return f'{model.service_model.service_name}.{model.name}'
+
+
+def canonical(params):
+    return json.dumps(params, sort_keys=True, default=str)
+
+
+def keep_api_params(params, model, context, **kwargs):
+    """Keeps the operation and API parameters of the call, later events only get the serialized request
+    """
+    context['replay_model'] = model
+    context['replay_params'] = json.loads(canonical(params))
+
+
+class ReplayBody:
+    """Raw body of a replayed response, read by AWSResponse through stream()
+    """
+    def __init__(self, content):
+        self.content = content
+
+    def stream(self):
+        yield self.content
+
+
+def typed(value, shape):
+    """Value of a JSON response with the timestamps of the shape parsed back into datetimes, like botocore returns them
+    """
+    if shape is None or value is None:
+        return value
+    if shape.type_name == 'structure' and isinstance(value, dict):
+        return {key: typed(member, shape.members.get(key)) for key, member in value.items()}
+    if shape.type_name == 'list' and isinstance(value, list):
+        return [typed(member, shape.member) for member in value]
+    if shape.type_name == 'map' and isinstance(value, dict):
+        return {key: typed(member, shape.value) for key, member in value.items()}
+    if shape.type_name == 'timestamp' and isinstance(value, (str, int, float)):
+        return parse_timestamp(value)
+    return value
+
+
+def empty_body(operation_model, status):
+    """Smallest body the protocol parser of the operation accepts, XML protocols need a root element
+    and successful query responses their result element
+    """
+    if operation_model.service_model.resolved_protocol not in ('query', 'ec2', 'rest-xml'):
+        return b''
+    output_shape = operation_model.output_shape
+    wrapper = output_shape.serialization.get('resultWrapper') if output_shape is not None and status < 300 else None
+    return f'<Response><{wrapper}/></Response>'.encode('utf-8') if wrapper else b'<Response/>'
+
+
+def start_capture():
+    """Records every call of clients created from now on. Returns the recording, a list per operation
+    """
+    recording = {}
+    recording_lock = threading.Lock()
+
+    def record_call(http_response, parsed, model, context, **kwargs):
+        response = {key: value for key, value in parsed.items() if key != 'ResponseMetadata'}
+        with recording_lock:
+            recording.setdefault(operation_key(model), []).append({
+                'Region': context['client_region'],
+                'Params': context.get('replay_params', {}),
+                'Status': http_response.status_code,
+                'Response': json.loads(canonical(response))
+            })
+
+    resource_collector.client_event_handlers.append(('before-parameter-build', keep_api_params))
+    resource_collector.client_event_handlers.append(('after-call', record_call))
+    return recording
+
+
+def save_fixtures(recording, fixture_file):
+    try:
+        with open(fixture_file, "w", encoding="utf-8") as f:
+            f.write(json.dumps(recording, indent=1, default=str))
+    finally:
+        f.close()
+    print(f'Recorded {sum(len(calls) for calls in recording.values())} calls of {len(recording)} operations '
+          f'to {fixture_file}')
+
+
+def fixture_responder(fixture_file, round_robin=False):
+    """Answers a call with the recorded response of the same operation, region and parameters. Calls of global
+    services match recordings of any region, the region pass that decorates a global resource varies between runs.
+    Other calls raise LookupError, or with round_robin get the recorded responses of the operation in turn.
+    Either way they are counted as misses in replay_stats
+    """
+    try:
+        with open(fixture_file, "r", encoding="utf-8") as f:
+            recording = json.load(f)
+    finally:
+        f.close()
+    exact = {}
+    for operation, calls in recording.items():
+        for call in calls:
+            exact.setdefault((operation, call['Region'], canonical(call['Params'])), call)
+            if operation.split('.')[0] in resource_collector.global_services:
+                exact.setdefault((operation, None, canonical(call['Params'])), call)
+    turns = Counter()
+    turns_lock = threading.Lock()
+
+    def respond(operation, region, params):
+        call = exact.get((operation, region, canonical(params)))
+        if call is None and operation.split('.')[0] in resource_collector.global_services:
+            call = exact.get((operation, None, canonical(params)))
+        if call is None:
+            with replay_stats_lock:
+                replay_stats['misses'][operation] += 1
+            if not round_robin:
+                raise LookupError(f'{operation} in {region} was not recorded with parameters {canonical(params)}')
+            calls = recording.get(operation)
+            if not calls:
+                return 400, {'Error': {'Code': 'ReplayMissing', 'Message': f'{operation} was not recorded'}}
+            with turns_lock:
+                call = calls[turns[operation] % len(calls)]
+                turns[operation] += 1
+        return call['Status'], call['Response']
+
+    return respond
+
+
+def start_replay(respond, latency=0.0, throttle_rate=0.0):
+    """Answers every attempt of every call of clients created from now on with
+    respond(operation, region, params) -> (status, response), operation being 'service.Operation'.
+    Nothing is sent to AWS
+    """
+    def replay_send(request, **kwargs):
+        model = request.context['replay_model']
+        operation = operation_key(model)
+        time.sleep(latency)
+        if random.random() < throttle_rate:
+            with replay_stats_lock:
+                replay_stats['throttles'][operation] += 1
+            status, response = 400, {'Error': {'Code': 'Throttling', 'Message': 'Rate exceeded (replay)'}}
+        else:
+            with replay_stats_lock:
+                replay_stats['calls'][operation] += 1
+            status, response = respond(operation, request.context['client_region'],
+                                       request.context.get('replay_params', {}))
+        return AWSResponse(request.url, status, {replay_header: json.dumps(response, default=str)},
+                           ReplayBody(empty_body(model, status)))
+
+    def replay_parse(operation_model, response_dict, customized_response_dict, **kwargs):
+        if replay_header not in response_dict['headers']:
+            return
+        response = json.loads(response_dict['headers'].pop(replay_header))
+        response.pop('ResponseMetadata', None)
+        if response_dict['status_code'] < 300:
+            response = typed(response, operation_model.output_shape)
+        # The protocol parser only adds the response metadata
+        customized_response_dict.update(response)
+
+    # Requests are signed but never sent, any credentials do
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'replay')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'replay')
+    resource_collector.client_event_handlers.append(('before-parameter-build', keep_api_params))
+    resource_collector.client_event_handlers.append(('before-send', replay_send))
+    resource_collector.client_event_handlers.append(('before-parse', replay_parse))
+
+
+def print_replay_stats():
+    for operation, calls in sorted(replay_stats['calls'].items()):
+        print(f'{operation}: {calls} calls, {replay_stats["throttles"][operation]} throttled attempts, '
+              f'{replay_stats["misses"][operation]} not recorded')
+    print(f'{sum(replay_stats["calls"].values())} calls in total, '
+          f'{sum(replay_stats["misses"].values())} not matched by a recorded call')
+
+
+def main():
+    round_robin = '--round-robin' in sys.argv
+    args = [arg for arg in sys.argv if arg != '--round-robin']
+    if len(args) < 3 or args[1] not in ('capture', 'replay'):
+        print(__doc__)
+        sys.exit(1)
+    mode, fixture_file = args[1], args[2]
+    if mode == 'capture':
+        recording = start_capture()
+        resource_collector.handler()
+        save_fixtures(recording, fixture_file)
+        return
+
+    latency = float(args[3]) if len(args) > 3 else 0.0
+    throttle_rate = float(args[4]) if len(args) > 4 else 0.0
+    start_replay(fixture_responder(fixture_file, round_robin), latency, throttle_rate)
+    start = time.perf_counter()
+    resource_collector.handler()
+    print(f'Replayed collection in {time.perf_counter() - start:.2f}s')
+    print_replay_stats()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,249 +1,650 @@
 import boto3
+import contextvars
+import gzip
+import hashlib
+import heapq
 import json
 import math
+import os
+import threading
+import time
 from botocore.config import Config
+from botocore.credentials import RefreshableCredentials
+from botocore.exceptions import ClientError
+from botocore.session import get_session
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 singletons = []
-direct_connects = []
-direct_connect_vifs = []
+direct_connects = {}
+direct_connect_vifs = {}
+direct_connect_lock = threading.Lock()
+client_pool = {}
+client_pool_lock = threading.Lock()
+client_pool_stats = {'created': 0, 'reused': 0}
+region_inventories = {}
+region_inventories_lock = threading.Lock()
+region_indexes = {}
+region_index_locks = {}
+ec2_batch_size = 200
+tag_values_per_request = 5
+ecs_describe_services_batch_size = 10
+ecs_describe_clusters_batch_size = 100
+elb_batch_size = 20
+lambda_page_size = 50
+# Fields get_function_configuration returns and list_functions does not, dropped so every Configuration has the same shape
+lambda_state_fields = ['State', 'StateReason', 'StateReasonCode', 'LastUpdateStatus', 'LastUpdateStatusReason',
+                       'LastUpdateStatusReasonCode']
+# Queue attributes the SQS widget sets read
+sqs_attribute_names = ['FifoQueue', 'MaximumMessageSize', 'MessageRetentionPeriod', 'RedrivePolicy']
+# Error codes of a queue URL that does not resolve, the only errors fetch_queue_attributes looks the URL up for
+sqs_missing_queue_error_codes = ['AWS.SimpleQueueService.NonExistentQueue', 'QueueDoesNotExist']
+# Calls a decorator spends on a resource without its region inventory where that is more than one,
+# estimates for the calls avoided by the inventories
+fallback_calls = {'ec2': 2, 'elbv2': 2, 'ecs': 4, 'network-firewall': 3}
+# Namespaces whose metrics are kept in the metric index for decorator lookups, others only record the namespace
+indexed_metric_namespaces = ['CWAgent', 'AWS/NetworkFirewall']
+
+# Decorators of these services build shared state in discovery order and are never run concurrently
+ordered_services = ['directconnect']
+# Resources of these services are not regional, every region pass can discover them but they are decorated once per run
+global_services = ['s3', 'cloudfront']
+global_resources = {}
+global_resources_lock = threading.Lock()
+decoration_cache = {'entries': {}, 'seen': set(), 'hits': 0, 'misses': 0, 'evicted': 0}
+decoration_cache_lock = threading.Lock()
+namespace_cache = {'config': {}, 'entries': {}}
+namespace_cache_lock = threading.Lock()
+inventory_stats = {}
+inventory_stats_lock = threading.Lock()
+# Account collected by the current thread in multi-account mode, None collects with the credentials of the run
+current_account = contextvars.ContextVar('current_account', default=None)
+account_sessions = {}
+account_session_locks = {}
+account_sessions_lock = threading.Lock()
+# (event name, handler) pairs registered on every new client, for tooling that hooks botocore events
+client_event_handlers = []
+# Error codes the standard retry mode of botocore treats as throttling
+throttling_error_codes = [
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException', 'TooManyRequestsException',
+    'ProvisionedThroughputExceededException', 'TransactionInProgressException', 'RequestLimitExceeded',
+    'BandwidthLimitExceeded', 'LimitExceededException', 'RequestThrottled', 'SlowDown', 'PriorRequestNotComplete',
+    'EC2ThrottledException'
+]
+collection_report = {'enabled': False, 'api': {}, 'decorators': {}, 'stages': {}, 'slowest': [], 'slowestCount': 10}
+collection_report_lock = threading.Lock()
+
+
+def get_client(service, config, session=None):
+    """Shared boto3 client for the service, region, retry mode and credentials.
+    The session defaults to the one of the account the current thread collects.
+    Clients are thread safe once created but creating them from a session is not,
+    so creation happens under a lock. Every lookup is counted in client_pool_stats
+    """
+    if session is None:
+        session = account_session(current_account.get(), config.region_name)
+    with client_pool_lock:
+        key = (service, config.region_name, (config.retries or {}).get('mode'), session.get_credentials())
+        client = client_pool.get(key)
+        if client is None:
+            client = session.client(service, config=config)
+            for event_name, event_handler in client_event_handlers:
+                client.meta.events.register(event_name, event_handler)
+            client_pool[key] = client
+            client_pool_stats['created'] += 1
+        else:
+            client_pool_stats['reused'] += 1
+    return client
+
 
+def default_session():
+    with client_pool_lock:
+        if boto3.DEFAULT_SESSION is None:
+            boto3.setup_default_session()
+        return boto3.DEFAULT_SESSION
 
-def get_resources(tag_name, tag_values, config):
-    """Get resources from resource groups and tagging API.
-    Assembles resources in a list containing only ARN and tags
+
+def assume_role_session(role_arn, region):
+    """Session with the credentials of the role. They are refreshed by assuming the role again before they expire
     """
-    resourcetaggingapi = boto3.client('resourcegroupstaggingapi', config=config)
-    resources = []
+    sts = get_client('sts', get_config(region), default_session())
+
+    def refresh():
+        credentials = sts.assume_role(
+            RoleArn=role_arn,
+            RoleSessionName='ResourceCollector'
+        )['Credentials']
+        return {
+            'access_key': credentials['AccessKeyId'],
+            'secret_key': credentials['SecretAccessKey'],
+            'token': credentials['SessionToken'],
+            'expiry_time': credentials['Expiration'].isoformat()
+        }
 
-    tags = len(tag_values)
-    if tags > 5:
-        tags_processed = 0
-        while tags_processed < tags:
-            incremental_tag_values = tag_values[tags_processed:tags_processed+5]
-            resources = get_resources_from_api(resourcetaggingapi, resources, tag_name, incremental_tag_values)
-            tags_processed += 5
-    else:
-        resources = get_resources_from_api(resourcetaggingapi, resources, tag_name, tag_values)
-    resources.extend(autoscaling_retriever(tag_name, tag_values, config))
-    return resources
+    botocore_session = get_session()
+    botocore_session._credentials = RefreshableCredentials.create_from_metadata(
+        metadata=refresh(), refresh_using=refresh, method='sts-assume-role')
+    return boto3.Session(botocore_session=botocore_session)
 
 
-def get_resources_from_api(resourcetaggingapi, resources, tag_name, tag_values):
-    response = resourcetaggingapi.get_resources(
-        TagFilters=[
-            {
-                'Key': tag_name,
-                'Values': tag_values
-            },
-        ],
-        ResourcesPerPage=40
-    )
+def account_session(account, region):
+    """Session of the account, assumed once per role and shared by all threads collecting it.
+    '{region}' in the role name is replaced with the region, for roles deployed per region
+    """
+    if account is None or account['RoleName'] is None:
+        return default_session()
+    role_arn = f'arn:aws:iam::{account["Id"]}:role/{account["RoleName"].format(region=region)}'
+    with account_sessions_lock:
+        lock = account_session_locks.setdefault(role_arn, threading.Lock())
+    with lock:
+        if role_arn not in account_sessions:
+            account_sessions[role_arn] = assume_role_session(role_arn, region)
+        return account_sessions[role_arn]
+
+
+def in_current_account(function):
+    """Wraps function so worker threads run it for the account of the calling thread
+    """
+    account = current_account.get()
+
+    def run(*args):
+        token = current_account.set(account)
+        try:
+            return function(*args)
+        finally:
+            current_account.reset(token)
+    return run
+
+
+def region_key(region, account):
+    """Key of per-region state and output, qualified by the account in multi-account mode
+    """
+    return f'{account["Id"]}/{region}' if account else region
+
+
+def region_inventory(name, config):
+    """Per-region store that batch stages fill before decoration and decorators read from
+    """
+    with region_inventories_lock:
+        return region_inventories.setdefault((name, region_key(config.region_name, current_account.get())), {})
+
+
+def region_index(name, config, builder):
+    """Per-region index built by builder(config) on first use.
+    Concurrent callers of the same region wait for the first build instead of repeating it
+    """
+    key = (name, region_key(config.region_name, current_account.get()))
+    with region_inventories_lock:
+        lock = region_index_locks.setdefault(key, threading.Lock())
+    with lock:
+        if key not in region_indexes:
+            index = builder(config)
+            with region_inventories_lock:
+                region_indexes[key] = index
+        return region_indexes[key]
+
+
+def release_region(region):
+    """Frees the inventories, indexes and clients of a finished region pass of the current account,
+    and the session of roles deployed per region
+    """
+    account = current_account.get()
+    key = region_key(region, account)
+    with region_inventories_lock:
+        for state in (region_inventories, region_indexes, region_index_locks):
+            for state_key in [state_key for state_key in state if state_key[1] == key]:
+                del state[state_key]
+    credentials = account_session(account, region).get_credentials()
+    with client_pool_lock:
+        for client_key in [client_key for client_key in client_pool
+                           if client_key[1] == region and client_key[3] is credentials]:
+            del client_pool[client_key]
+    if account and account['RoleName'] and '{region}' in account['RoleName']:
+        with account_sessions_lock:
+            account_sessions.pop(f'arn:aws:iam::{account["Id"]}:role/{account["RoleName"].format(region=region)}', None)
+
+
+def count_inventory(service, key, count=1):
+    """Counts API calls spent on region inventories ('calls'), resources served from them ('served'),
+    resources that still needed their own call ('fallbacks') and resources missing from a built inventory ('misses')
+    """
+    with inventory_stats_lock:
+        stats = inventory_stats.setdefault(service, {'calls': 0, 'served': 0, 'fallbacks': 0, 'misses': 0})
+        stats[key] += count
+
+
+def print_inventory_stats():
+    avoided = 0
+    for service, stats in inventory_stats.items():
+        service_avoided = stats['served'] * fallback_calls.get(service, 1) - stats['calls']
+        print(f'{service}: {stats["served"]} resources served by {stats["calls"]} inventory calls, '
+              f'{stats["fallbacks"]} fallbacks, {stats["misses"]} misses, {service_avoided} calls avoided')
+        avoided += service_avoided
+    if inventory_stats:
+        print(f'Region inventories avoided {avoided} calls in total')
+
+
+def report_api_stats(model, context):
+    """Counters of the operation in the region of the call, callers hold collection_report_lock
+    """
+    key = (region_key(context['client_region'], current_account.get()),
+           f'{model.service_model.service_name}.{model.name}')
+    return collection_report['api'].setdefault(key, {'calls': 0, 'retries': 0, 'throttles': 0, 'errors': 0})
+
+
+def report_api_call(parsed, model, context, **kwargs):
+    """after-call handler counting every API call, its retries and whether it failed
+    """
+    metadata = parsed.get('ResponseMetadata', {})
+    with collection_report_lock:
+        stats = report_api_stats(model, context)
+        stats['calls'] += 1
+        stats['retries'] += metadata.get('RetryAttempts', 0)
+        if 'Error' in parsed:
+            stats['errors'] += 1
+
+
+def report_throttle(response, operation, request_dict, **kwargs):
+    """needs-retry handler counting throttled attempts. It returns None, the retry handler of the client decides
+    """
+    if response is None:
+        return
+    http_response, parsed = response
+    if parsed.get('Error', {}).get('Code') in throttling_error_codes or http_response.status_code == 429:
+        with collection_report_lock:
+            report_api_stats(operation, request_dict['context'])['throttles'] += 1
+
+
+def record_timing(table, name, seconds, arn=None):
+    """Adds a decorator or batch stage run to the report, decorator runs also compete for the slowest resources
+    """
+    with collection_report_lock:
+        stats = collection_report[table].setdefault(name, {'runs': 0, 'seconds': 0.0, 'maxSeconds': 0.0})
+        stats['runs'] += 1
+        stats['seconds'] += seconds
+        stats['maxSeconds'] = max(stats['maxSeconds'], seconds)
+        if arn is not None:
+            slowest = collection_report['slowest']
+            if len(slowest) < collection_report['slowestCount']:
+                heapq.heappush(slowest, (seconds, arn, name))
+            elif seconds > slowest[0][0]:
+                heapq.heapreplace(slowest, (seconds, arn, name))
+
+
+def start_collection_report(report_config):
+    """Turns on API call accounting for clients created from now on and decorator timing.
+    Costs a counter update per API call and two clock reads per decorated resource
+    """
+    if not report_config.get('enabled'):
+        return
+    collection_report['enabled'] = True
+    collection_report['slowestCount'] = report_config.get('slowest', 10)
+    for event_handler in [('after-call', report_api_call), ('needs-retry', report_throttle)]:
+        if event_handler not in client_event_handlers:
+            client_event_handlers.append(event_handler)
+
+
+def save_collection_report(report_config, seconds):
+    """Writes the JSON report and prints the slowest resources, the most expensive decorators and API calls per region
+    """
+    if not collection_report['enabled']:
+        return
+    regions = {}
+    for (key, _), stats in collection_report['api'].items():
+        totals = regions.setdefault(key, {'calls': 0, 'retries': 0, 'throttles': 0, 'errors': 0})
+        for counter, count in stats.items():
+            totals[counter] += count
+    report = {
+        'seconds': seconds,
+        'regions': dict(sorted(regions.items())),
+        'apiCalls': [dict(region=key, operation=operation, **stats)
+                     for (key, operation), stats in sorted(collection_report['api'].items())],
+        'decorators': dict(sorted(collection_report['decorators'].items(), key=lambda item: -item[1]['seconds'])),
+        'batchStages': dict(sorted(collection_report['stages'].items(), key=lambda item: -item[1]['seconds'])),
+        'slowestResources': [{'ResourceARN': arn, 'decorator': name, 'seconds': slow_seconds}
+                             for slow_seconds, arn, name in sorted(collection_report['slowest'], reverse=True)],
+        'inventories': dict(sorted(inventory_stats.items()))
+    }
+    try:
+        with open(report_config.get('file', 'collection_report.json'), "w", encoding="utf-8") as f:
+            f.write(json.dumps(report, indent=4))
+    finally:
+        f.close()
+
+    print(f'Collection took {seconds:.1f}s')
+    for key, totals in report['regions'].items():
+        print(f'{key}: {totals["calls"]} API calls, {totals["retries"]} retries, {totals["throttles"]} throttled, '
+              f'{totals["errors"]} failed')
+    for name, stats in list(report['decorators'].items())[:5]:
+        print(f'{name}: {stats["seconds"]:.2f}s for {stats["runs"]} resources, slowest {stats["maxSeconds"]:.2f}s')
+    for slow in report['slowestResources'][:5]:
+        print(f'Slow resource {slow["ResourceARN"]}: {slow["seconds"]:.2f}s in {slow["decorator"]}')
+    print(f'Collection report written to {report_config.get("file", "collection_report.json")}')
 
-    resources.extend(response['ResourceTagMappingList'])
-    while response['PaginationToken'] != '':
-        print('Got the pagination token')
-        response = resourcetaggingapi.get_resources(
-            PaginationToken=response['PaginationToken'],
+
+def map_concurrently(function, items, workers):
+    """Applies function to every item on up to 'workers' threads, results are in input order
+    """
+    if workers <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(in_current_account(function), items))
+
+
+def chunks(items, size):
+    for index in range(0, len(items), size):
+        yield items[index:index+size]
+
+
+def get_resources(tag_name, tag_values, config, workers=1):
+    """Get resources from resource groups and tagging API and autoscaling groups from the autoscaling API.
+    Tag values are requested in chunks, chunks run concurrently on up to 'workers' threads.
+    Assembles resources in a list containing only ARN and tags, deduplicated by ARN in chunk order
+    """
+    requests = [(get_resources_from_api, chunk) for chunk in chunks(tag_values, tag_values_per_request)]
+    requests.extend((get_asgs_from_api, chunk) for chunk in chunks(tag_values, tag_values_per_request))
+
+    def fetch(request):
+        retriever, tag_values_chunk = request
+        start = time.time()
+        chunk_resources, pages = retriever(tag_name, tag_values_chunk, config)
+        print(f'{retriever.__name__} {config.region_name} {tag_values_chunk}: {len(chunk_resources)} resources '
+              f'in {pages} pages, {time.time() - start:.2f}s')
+        return chunk_resources
+
+    resources = []
+    seen_arns = set()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for chunk_resources in executor.map(in_current_account(fetch), requests):
+            for resource in chunk_resources:
+                if resource['ResourceARN'] not in seen_arns:
+                    seen_arns.add(resource['ResourceARN'])
+                    resources.append(resource)
+    return resources
+
+
+def get_resources_from_api(tag_name, tag_values, config):
+    """Returns tagged resources and the number of pages fetched
+    """
+    resourcetaggingapi = get_client('resourcegroupstaggingapi', config)
+    resources = []
+    pages = 0
+    for page in resourcetaggingapi.get_paginator('get_resources').paginate(
             TagFilters=[
                 {
                     'Key': tag_name,
                     'Values': tag_values
                 },
             ],
-            ResourcesPerPage=40
-        )
-        resources.extend(response['ResourceTagMappingList'])
+            PaginationConfig={'PageSize': 100}):
+        pages += 1
+        resources.extend(page['ResourceTagMappingList'])
 
-    return resources
-
-
-def autoscaling_retriever(tag_name, tag_values, config):
-    resources = []
-    tags = len(tag_values)
-    if tags > 5:
-        tags_processed = 0
-        while tags_processed < tags:
-            incremental_tag_values = tag_values[tags_processed:tags_processed+5]
-            resources.extend(get_asgs_from_api(tag_name, incremental_tag_values, config))
-            tags_processed += 5
-    else:
-        resources.extend(get_asgs_from_api(tag_name, tag_values, config))
-
-    return resources
+    return resources, pages
 
 
 def get_asgs_from_api(tag_name, tag_values, config):
     """Autoscaling is not supported by resource groups and tagging api
-    This is
-    :return:
+    Returns tagged autoscaling groups and the number of pages fetched
     """
-    asg = boto3.client('autoscaling', config=config)
+    asg = get_client('autoscaling', config)
     resources = []
-    response = asg.describe_auto_scaling_groups(
-        Filters=[
-            {
-                'Name': 'tag:'+tag_name,
-                'Values': tag_values
-            }
-        ],
-        MaxRecords=10
-    )
-    resources.extend(response['AutoScalingGroups'])
-    try:
-        while response['NextToken']:
-            response = asg.describe_auto_scaling_groups(
-                NextToken=response['NextToken'],
-                Filters=[
-                    {
-                        'Name': 'tag:'+tag_name,
-                        'Values': tag_values
-                    }
-                ],
-                MaxRecords=10
-            )
-            resources.extend(response['AutoScalingGroups'])
-    except:
-        print(f'Done fetching autoscaling groups')
+    pages = 0
+    for page in asg.get_paginator('describe_auto_scaling_groups').paginate(
+            Filters=[
+                {
+                    'Name': 'tag:'+tag_name,
+                    'Values': tag_values
+                }
+            ],
+            PaginationConfig={'PageSize': 100}):
+        pages += 1
+        resources.extend(page['AutoScalingGroups'])
 
     for resource in resources:
         resource['ResourceARN'] = resource['AutoScalingGroupARN']
 
-    return resources
+    return resources, pages
+
+
+def load_namespace_cache(namespace_config):
+    namespace_cache['config'] = namespace_config
+    if not namespace_config.get('cacheFile'):
+        return
+    try:
+        with open(namespace_config['cacheFile'], "r", encoding="utf-8") as f:
+            namespace_cache['entries'] = json.load(f)
+    except FileNotFoundError:
+        print('No namespace cache yet, scanning all metrics')
+
+
+def save_namespace_cache():
+    if not namespace_cache['config'].get('cacheFile'):
+        return
+    try:
+        with open(namespace_cache['config']['cacheFile'], "w", encoding="utf-8") as f:
+            f.write(json.dumps(namespace_cache['entries'], indent=4))
+    finally:
+        f.close()
+
+
+def cached_namespaces(region):
+    """Namespaces of the region from the namespace cache, None when there is no fresh entry
+    """
+    namespace_config = namespace_cache['config']
+    if not namespace_config.get('cacheFile'):
+        return None
+    with namespace_cache_lock:
+        entry = namespace_cache['entries'].get(region)
+    if entry and time.time() - entry['ScannedAt'] <= namespace_config.get('cacheTtl', 3600) \
+            and entry['RecentlyActive'] == bool(namespace_config.get('recentlyActive')):
+        return entry['Namespaces']
+    return None
+
+
+def build_metric_index(config):
+    """Streams the metrics of the region once.
+    Records all namespaces in discovery order and, for indexed_metric_namespaces, the metrics by dimension.
+    When the namespace cache is fresh only the indexed namespaces are scanned
+    """
+    cw = get_client('cloudwatch', config)
+    namespace_config = namespace_cache['config']
+    list_metrics_args = {'RecentlyActive': 'PT3H'} if namespace_config.get('recentlyActive') else {}
+    namespaces = cached_namespaces(region_key(config.region_name, current_account.get()))
+    if namespaces is None:
+        print(f'Building metric index for {config.region_name}')
+        scans = [list_metrics_args]
+    else:
+        print(f'Building metric index for {config.region_name} from cached namespaces')
+        scans = [dict(list_metrics_args, Namespace=namespace) for namespace in indexed_metric_namespaces
+                 if namespace in namespaces]
+
+    index = {'Namespaces': dict.fromkeys(namespaces or []), 'Metrics': {}}
+    for scan in scans:
+        for page in cw.get_paginator('list_metrics').paginate(**scan):
+            for metric in page['Metrics']:
+                namespace = metric['Namespace']
+                index['Namespaces'][namespace] = True
+                if namespace in indexed_metric_namespaces:
+                    for dimension in metric.get('Dimensions', []):
+                        key = (namespace, dimension['Name'], dimension['Value'])
+                        index['Metrics'].setdefault(key, []).append(metric)
+
+    if namespaces is None and namespace_config.get('cacheFile'):
+        with namespace_cache_lock:
+            namespace_cache['entries'][region_key(config.region_name, current_account.get())] = {
+                'Namespaces': list(index['Namespaces']),
+                'ScannedAt': time.time(),
+                'RecentlyActive': bool(namespace_config.get('recentlyActive'))
+            }
+    return index
+
+
+def get_metric_index(config):
+    return region_index('metrics', config, build_metric_index)
+
+
+def find_metrics(config, namespace, dimension_name, dimension_value, metric_name=None):
+    """Metrics of an indexed namespace that have the given dimension, answered from the metric index
+    """
+    metrics = get_metric_index(config)['Metrics'].get((namespace, dimension_name, dimension_value), [])
+    if metric_name:
+        return [metric for metric in metrics if metric['MetricName'] == metric_name]
+    return metrics
 
 
 def cw_custom_namespace_retriever(config):
-    """Retrieving all custom namespaces
+    """Retrieving all custom namespaces, filtered by the include and exclude prefixes of the namespace config
     """
-    cw = boto3.client('cloudwatch', config=config)
+    namespace_config = namespace_cache['config']
+    include = namespace_config.get('include', [])
+    exclude = namespace_config.get('exclude', ['AWS/', 'CWAgent'])
     resources = []
-    response = cw.list_metrics()
-    for record in response['Metrics']:
-        if not record['Namespace'].startswith('AWS/') and not record['Namespace'].startswith('CWAgent') and record['Namespace'] not in resources:
-            resources.append(record['Namespace'])
-            print(resources)
-
-    try:
-        while response['NextToken']:
-            response = cw.list_metrics(
-                NextToken = response['NextToken']
-            )
-            for record in response['Metrics']:
-                if not record['Namespace'].startswith('AWS/') and not record['Namespace'].startswith('CWAgent') and record['Namespace'] not in resources:
-                    resources.append(record['Namespace'])
-                    print(resources)
-    except:
-        print(f'Done fetching cloudwatch namespaces')
+    for namespace in get_metric_index(config)['Namespaces']:
+        if include and not namespace.startswith(tuple(include)):
+            continue
+        if not namespace.startswith(tuple(exclude)):
+            resources.append(namespace)
+    print(f'Custom namespaces in {config.region_name}: {resources}')
     return resources
 
 
-def router(resource, config):
-    arn = resource['ResourceARN']
-    if ':apigateway:' in arn and '/restapis/' in arn and 'stages' not in arn:
-        resource = apigw1_decorator(resource, config)
-    elif ':apigateway:' in arn and '/apis/' in arn and 'stages' not in arn:
-        resource = apigw2_decorator(resource, config)
-    elif ':appsync:' in arn:
-        resource = appsync_decorator(resource, config)
-    elif ':rds:' in arn and ':cluster:' in arn:
-        resource = aurora_decorator(resource, config)
-    elif ':autoscaling:' in arn and ':autoScalingGroup:' in arn:
-        resource = autoscaling_decorator(resource, config)
-    elif ':capacity-reservation/' in arn:
-        resource = odcr_decorator(resource, config)
-    elif ':dynamodb:' in arn and ':table/' in arn:
-        resource = dynamodb_decorator(resource, config)
-    elif ':ec2:' in arn and ':instance/' in arn:
-        resource = ec2_decorator(resource, config)
-    elif 'lambda' in arn and 'function' in arn:
-        resource = lambda_decorator(resource, config)
-    elif 'elasticloadbalancing' in arn and '/net/' not in arn and '/app/' not in arn and ':targetgroup/' not in arn:
-        resource = elb1_decorator(resource, config)
-    elif 'elasticloadbalancing' in arn and ( '/net/' in arn or '/app/' in arn ) and ':targetgroup/' not in arn and ':listener/' not in arn:
-        resource = elb2_decorator(resource, config)
-    elif ':ecs:' in arn and ':cluster/' in arn:
-        resource = ecs_decorator(resource, config)
-    elif ':natgateway/' in arn and ':ec2:' in arn:
-        resource = natgw_decorator(resource, config)
-    elif ':transit-gateway/' in arn and ':ec2:' in arn:
-        resource = tgw_decorator(resource, config)
-    elif ':sqs:' in arn:
-        resource = sqs_decorator(resource, config)
-    elif 'arn:aws:s3:' in arn:
-        resource = s3_decorator(resource, config)
-    elif ':sns:' in arn:
-        resource = sns_decorator(resource, config)
-    elif ':cloudfront:' in arn and ':distribution/' in arn:
-        resource = cloudfront_decorator(resource, config)
-    elif ':elasticache:' in arn:
-        resource = elasticache_decorator(resource, config)
-    elif ':mediapackage:' in arn and ':channels/' in arn:
-        resource = mediapackage_decorator(resource, config)
-    elif ':medialive:' in arn and ':channel:' in arn:
-        resource = medialive_decorator(resource, config)
-    elif ':elasticfilesystem:' in arn:
-        resource = efs_decorator(resource, config)
-    elif 'arn:aws:elasticbeanstalk:' in arn:
-        resource = beanstalk_decorator(resource, config)
-    elif 'arn:aws:network-firewall:' in arn and ':firewall/' in arn:
-        resource = network_firewall_decorator(resource, config)
-    elif 'arn:aws:directconnect:' in arn and ':dxvif/' in arn:
-        resource = direct_connect_handler(resource, config)
-    elif 'arn:aws:networkmonitor:' in arn and ':monitor/' in arn:
-        resource = network_monitor_decorator(resource, config)
+def parse_arn(arn):
+    """Splits an ARN into (partition, service, region, account, resource-type, resource-id).
+    Path style resources (API Gateway) get their collection names as type, '/restapis/a1/stages/b1'
+    becomes 'restapis/stages'. Resources without a type (SQS queues, S3 buckets) get an empty type
+    """
+    parts = arn.split(':', 5)
+    if len(parts) < 6:
+        return '', '', '', '', '', arn
+    _, partition, service, region, account, resource = parts
+    if resource.startswith('/'):
+        segments = resource[1:].split('/')
+        return partition, service, region, account, '/'.join(segments[0::2]), '/'.join(segments[1::2])
+
+    slash = resource.find('/')
+    colon = resource.find(':')
+    separator = colon if slash < 0 or 0 <= colon < slash else slash
+    if separator < 0:
+        return partition, service, region, account, '', resource
+    resource_type, resource_id = resource[:separator], resource[separator + 1:]
+    if (service, resource_type) in subtyped_resources and '/' in resource_id:
+        subtype, resource_id = resource_id.split('/', 1)
+        resource_type = f'{resource_type}/{subtype}'
+    return partition, service, region, account, resource_type, resource_id
+
+
+def get_decorator(arn):
+    """Decorator for the ARN from the decorators table, None for resource types that are not decorated
+    """
+    _, service, _, _, resource_type, _ = parse_arn(arn)
+    return decorators.get((service, resource_type)) or decorators.get((service, '*'))
+
+
+def route_resources(resources):
+    """Decorator of every resource in input order and the resources grouped by decorator, for the batch stages
+    """
+    routes = [get_decorator(resource['ResourceARN']) for resource in resources]
+    routed = {}
+    for resource, decorator in zip(resources, routes):
+        if decorator:
+            routed.setdefault(decorator, []).append(resource)
+    return routes, routed
+
+
+def routed_to(routed, decorator):
+    return routed.get(decorator, [])
+
+
+def decorate(resource, decorator, config):
+    if decorator and collection_report['enabled']:
+        arn = resource['ResourceARN']
+        start = time.perf_counter()
+        resource = decorator(resource, config)
+        record_timing('decorators', decorator.__name__, time.perf_counter() - start, arn)
+    elif decorator:
+        resource = decorator(resource, config)
     return resource
 
 
+def router(resource, config):
+    return decorate(resource, get_decorator(resource['ResourceARN']), config)
+
+
+def directconnect_batch_stage(routed, config, collector_config):
+    """Lists all virtual interfaces and connections of the region once and indexes them
+    by VIF ARN and connectionId for direct_connect_handler
+    """
+    vif_arns = list(dict.fromkeys(
+        resource['ResourceARN'] for resource in routed_to(routed, direct_connect_handler)
+    ))
+    if not vif_arns:
+        return
+    client = get_client('directconnect', config)
+    vifs = {vif['virtualInterfaceId']: vif for vif in client.describe_virtual_interfaces()['virtualInterfaces']}
+    connections = {connection['connectionId']: connection for connection in client.describe_connections()['connections']}
+    count_inventory('directconnect', 'calls', 2)
+    inventory = region_inventory('directconnect', config)
+    inventory['vifs'] = {arn: vifs[arn.split('/')[-1]] for arn in vif_arns if arn.split('/')[-1] in vifs}
+    inventory['connections'] = connections
+
+
 def direct_connect_handler(resource, config):
+    """Adds the VIF to the single entry of its connection, VIFs without a connection in this account
+    are kept separately. Returns nothing, the hierarchy is written after all regions are collected
+    """
     print(f'This resource is DX VIF {resource["ResourceARN"]}')
-    vif_id = resource['ResourceARN'].split('/')[1:][0]
-    client = boto3.client('directconnect', config=config)
-    response = client.describe_virtual_interfaces(
-        virtualInterfaceId=vif_id
-    )
-    resource['vif'] = response['virtualInterfaces'][0]
-    connection_id = resource['vif']['connectionId']
-
-    if direct_connects:
-        for direct_connect in direct_connects:
-            if connection_id not in direct_connect['connectionId']:
-                handle_new_direct_connect_connection(resource, config, connection_id)
-                break
-            else:
-                direct_connect['VIFs'].append(resource)
-                break
+    inventory = region_inventory('directconnect', config)
+    vif = inventory.get('vifs', {}).get(resource['ResourceARN'])
+    if vif is None:
+        count_inventory('directconnect', 'fallbacks')
+        vif_id = resource['ResourceARN'].split('/')[1:][0]
+        client = get_client('directconnect', config)
+        response = client.describe_virtual_interfaces(
+            virtualInterfaceId=vif_id
+        )
+        vif = response['virtualInterfaces'][0]
     else:
-        handle_new_direct_connect_connection(resource, config, connection_id)
+        count_inventory('directconnect', 'served')
+    resource['vif'] = vif
+    connection_id = vif['connectionId']
+    region = resource['ResourceARN'].split(':')[3]
+    account_id = resource['ResourceARN'].split(':')[4]
+    connection_arn = f'arn:aws:directconnect:{region}:{account_id}:dxcon/{connection_id}'
 
+    with direct_connect_lock:
+        direct_connect = direct_connects.get(connection_arn)
+        if direct_connect is not None:
+            direct_connect['VIFs'].append(resource)
+            return
 
+    if 'connections' in inventory:
+        connection = inventory['connections'].get(connection_id)
+    else:
+        client = get_client('directconnect', config)
+        response = client.describe_connections(
+            connectionId=connection_id
+        )
+        connection = response['connections'][0] if response['connections'] else None
 
-def handle_new_direct_connect_connection(resource, config, connection_id):
-    client = boto3.client('directconnect', config=config)
-    region = resource['ResourceARN'].split(':')[3]
-    account_id = resource['ResourceARN'].split(':')[4]
-    response = client.describe_connections(
-        connectionId=resource['vif']['connectionId']
-    )
-    if response['connections']:
-        top_resource = {'DirectConnect': response['connections'][0],
-                        'ResourceARN': f'arn:aws:directconnect:{region}:{account_id}:dxcon/{connection_id}',
-                        'connectionId': connection_id,
-                        'VIFs': [resource]}
-        direct_connects.append(top_resource)
-    else:  # Some VIFs do not attach to real connection, handle them separately
-        append = True
-        for vif in direct_connect_vifs:
-            if vif['ResourceARN'] == resource['ResourceARN']:
-                append = False
-                break
-
-        if append:
-            direct_connect_vifs.append(resource)
+    with direct_connect_lock:
+        if connection is None:  # Some VIFs do not attach to real connection, handle them separately
+            direct_connect_vifs.setdefault(resource['ResourceARN'], resource)
+        elif connection_arn in direct_connects:
+            direct_connects[connection_arn]['VIFs'].append(resource)
+        else:
+            direct_connects[connection_arn] = {'DirectConnect': connection,
+                                               'ResourceARN': connection_arn,
+                                               'connectionId': connection_id,
+                                               'VIFs': [resource]}
+            if 'AccountId' in resource:
+                direct_connects[connection_arn]['AccountId'] = resource['AccountId']
 
 
 def apigw1_decorator(resource, config):
     print(f'This resource is API Gateway 1 {resource["ResourceARN"]}')
     apiid = resource['ResourceARN'].split('/')[len(resource['ResourceARN'].split('/'))-1]
-    apigw = boto3.client('apigateway', config=config)
+    apigw = get_client('apigateway', config)
     response = apigw.get_rest_api(
         restApiId=apiid
     )
@@ -260,7 +661,7 @@ def apigw1_decorator(resource, config):
 def apigw2_decorator(resource, config):
     print(f'This resource is API Gateway 2 {resource["ResourceARN"]}')
     apiid = resource['ResourceARN'].split('/')[len(resource['ResourceARN'].split('/')) - 1]
-    apigw = boto3.client('apigatewayv2', config=config)
+    apigw = get_client('apigatewayv2', config)
     response = apigw.get_api(
         ApiId=apiid
     )
@@ -275,7 +676,7 @@ def apigw2_decorator(resource, config):
 def appsync_decorator(resource, config):
     print(f'This resource is AppSync {resource["ResourceARN"]}')
     apiid = resource['ResourceARN'].split('/')[len(resource['ResourceARN'].split('/')) - 1]
-    appsync = boto3.client('appsync', config=config)
+    appsync = get_client('appsync', config)
     response = appsync.get_graphql_api(
         apiId=apiid
     )
@@ -288,29 +689,78 @@ def appsync_decorator(resource, config):
     return resource
 
 
+def rds_batch_stage(routed, config, collector_config):
+    """Pages the DB clusters and DB instances of the region once and indexes them by identifier
+    for aurora_decorator and rds_decorator
+    """
+    cluster_ids = [resource['ResourceARN'].split(':')[-1] for resource in routed_to(routed, aurora_decorator)]
+    instance_ids = [resource['ResourceARN'].split(':')[-1] for resource in routed_to(routed, rds_decorator)]
+    if not cluster_ids and not instance_ids:
+        return
+    rds = get_client('rds', config)
+    inventory = region_inventory('rds', config)
+    list_clusters = bool(cluster_ids)
+    if instance_ids:
+        instances = {}
+        for page in rds.get_paginator('describe_db_instances').paginate(PaginationConfig={'PageSize': 100}):
+            count_inventory('rds', 'calls')
+            for instance in page['DBInstances']:
+                instances[instance['DBInstanceIdentifier']] = instance
+        inventory['instances'] = instances
+        # Instances that are cluster members take their writer role from the cluster
+        list_clusters = list_clusters or any(
+            'DBClusterIdentifier' in instances.get(instance_id, {}) for instance_id in instance_ids)
+    if list_clusters:
+        clusters = {}
+        for page in rds.get_paginator('describe_db_clusters').paginate(PaginationConfig={'PageSize': 100}):
+            count_inventory('rds', 'calls')
+            for cluster in page['DBClusters']:
+                clusters[cluster['DBClusterIdentifier']] = cluster
+        inventory['clusters'] = clusters
+
+
+def copy_fields(resource, source, fields):
+    """Copies fields from an API response to the resource and reports the ones the response does not have
+    """
+    missing_fields = []
+    for field in fields:
+        if field in source:
+            resource[field] = source[field]
+        else:
+            missing_fields.append(field)
+    if missing_fields:
+        print(f'Could not populate {", ".join(missing_fields)} of {resource["ResourceARN"]}')
+    return resource
+
+
 def aurora_decorator(resource, config):
     print(f'This resource is Aurora {resource["ResourceARN"]}')
     clusterid = resource['ResourceARN'].split(':')[len(resource['ResourceARN'].split(':')) - 1]
-    rds = boto3.client('rds', config=config)
-    try:
-        response = rds.describe_db_clusters(
-            DBClusterIdentifier=clusterid
-        )
-        resource['MultiAZ'] = response['DBClusters'][0]['MultiAZ']
-        resource['Engine'] = response['DBClusters'][0]['Engine']
-        resource['EngineMode'] = response['DBClusters'][0]['EngineMode']
-        resource['DBClusterMembers'] = response['DBClusters'][0]['DBClusterMembers']
-        resource['Endpoint'] = response['DBClusters'][0]['Endpoint']
-        resource['ReaderEndpoint'] = response['DBClusters'][0]['ReaderEndpoint']
-        resource['EngineVersion'] = response['DBClusters'][0]['EngineVersion']
-        resource['ReadReplicaIdentifiers'] = response['DBClusters'][0]['ReadReplicaIdentifiers']
-        resource['DBClusterInstanceClass'] = resource['DBClusters'][0]['DBClusterInstanceClass']
-        resource['StorageType'] = response['DBClusters'][0]['StorageType']
-        resource['Iops'] = response['DBClusters'][0]['Iops']
-        resource['PerformanceInsightsEnabled'] = response['DBClusters'][0]['PerformanceInsightsEnabled']
-    except:
+    inventory = region_inventory('rds', config)
+    if 'clusters' in inventory:
+        cluster = inventory['clusters'].get(clusterid)
+        count_inventory('rds', 'served' if cluster else 'misses')
+    else:
+        count_inventory('rds', 'fallbacks')
+        rds = get_client('rds', config)
+        try:
+            response = rds.describe_db_clusters(
+                DBClusterIdentifier=clusterid
+            )
+            cluster = response['DBClusters'][0]
+        except ClientError as error:
+            print(f'Could not describe cluster {clusterid}: {error}')
+            cluster = None
+    if cluster is None:
         print('Just aurora-resource')
-
+        return resource
+
+    copy_fields(resource, cluster, [
+        'MultiAZ', 'Engine', 'EngineMode', 'DBClusterMembers', 'Endpoint', 'ReaderEndpoint', 'EngineVersion',
+        'ReadReplicaIdentifiers', 'DBClusterInstanceClass', 'StorageType', 'PerformanceInsightsEnabled'
+    ])
+    if 'Iops' in cluster:
+        resource['Iops'] = cluster['Iops']
     return resource
 
 
@@ -325,7 +775,7 @@ def beanstalk_decorator(resource, config):
 
 def cloudfront_decorator(resource, config):
     print(f'This resource is CloudFront distribution')
-    client = boto3.client('cloudfront', config=config)
+    client = get_client('cloudfront', config)
     response = client.get_distribution(
         Id = resource['ResourceARN'].split('/')[len(resource['ResourceARN'].split('/'))-1]
     )
@@ -337,49 +787,124 @@ def cloudfront_decorator(resource, config):
     return resource
 
 
+def build_mediapackage_channel_index(config):
+    client = get_client('mediapackage', config)
+    channels = {}
+    for page in client.get_paginator('list_channels').paginate():
+        for channel in page['Channels']:
+            channels[channel['Arn']] = channel
+    return channels
+
+
+def fetch_mediapackage_channel_details(channel, config, counted_service=None):
+    """Ingest and origin endpoints of the channel, the calls count as inventory calls of counted_service when set
+    """
+    client = get_client('mediapackage', config)
+    ingest_endpoints = channel.get('HlsIngest', {}).get('IngestEndpoints')
+    if ingest_endpoints is None:
+        response = client.describe_channel(Id=channel['Id'])
+        if counted_service:
+            count_inventory(counted_service, 'calls')
+        ingest_endpoints = response['HlsIngest']['IngestEndpoints']
+    origin_endpoints = []
+    for page in client.get_paginator('list_origin_endpoints').paginate(ChannelId=channel['Id']):
+        if counted_service:
+            count_inventory(counted_service, 'calls')
+        origin_endpoints.extend(page['OriginEndpoints'])
+    return {'IngestEndpoints': ingest_endpoints, 'OriginEndpoints': origin_endpoints}
+
+
+def mediapackage_batch_stage(routed, config, collector_config):
+    """Fetches ingest and origin endpoints of the tagged MediaPackage channels with bounded concurrency
+    """
+    arns = [resource['ResourceARN'] for resource in routed_to(routed, mediapackage_decorator)]
+    if not arns:
+        return
+    channels = region_index('mediapackage_channels', config, build_mediapackage_channel_index)
+    tagged_channels = [channels[arn] for arn in arns if arn in channels]
+    details = map_concurrently(lambda channel: fetch_mediapackage_channel_details(channel, config, 'mediapackage'),
+                               tagged_channels, service_limit('mediapackage', collector_config))
+    inventory = region_inventory('mediapackage', config)
+    for channel, channel_details in zip(tagged_channels, details):
+        inventory[channel['Arn']] = channel_details
+
+
 def mediapackage_decorator(resource, config):
     print(f'this resource is Mediapackage channel')
     arn = resource['ResourceARN']
-    client = boto3.client('mediapackage', config=config)
-    response = client.list_channels(
-        MaxResults=40,
-    
-    )
-    for i in range(len(response['Channels'])):
-        if (arn == response['Channels'][i]['Arn']):
-            resource['Id'] = response['Channels'][i]['Id']
-            resource['ARN'] = response['Channels'][i]['Arn']
-            response2 = client.describe_channel(Id = response['Channels'][i]['Id'])
-            origin_endpoint = client.list_origin_endpoints(
-                ChannelId = response['Channels'][i]['Id']
-                )
-            resource ['IngestEndpoint'] = response2['HlsIngest']['IngestEndpoints']
-            resource['OriginEndpoint'] = origin_endpoint['OriginEndpoints']
+    channel = region_index('mediapackage_channels', config, build_mediapackage_channel_index).get(arn)
+    if channel is None:
+        count_inventory('mediapackage', 'misses')
+    else:
+        details = region_inventory('mediapackage', config).get(arn)
+        if details is None:
+            count_inventory('mediapackage', 'fallbacks')
+            details = fetch_mediapackage_channel_details(channel, config)
+        else:
+            count_inventory('mediapackage', 'served')
+        resource['Id'] = channel['Id']
+        resource['ARN'] = channel['Arn']
+        resource['IngestEndpoint'] = details['IngestEndpoints']
+        resource['OriginEndpoint'] = details['OriginEndpoints']
     return resource
 
 
+def build_medialive_channel_index(config):
+    client = get_client('medialive', config)
+    channels = {}
+    for page in client.get_paginator('list_channels').paginate():
+        for channel in page['Channels']:
+            channels[channel['Arn']] = channel
+    return channels
+
+
+def fetch_medialive_pipeline_details(channel, config):
+    client = get_client('medialive', config)
+    response = client.describe_channel(
+        ChannelId=channel['Id']
+    )
+    return response['PipelineDetails']
+
+
+def medialive_batch_stage(routed, config, collector_config):
+    """Fetches pipeline details of the tagged MediaLive channels with bounded concurrency
+    """
+    arns = [resource['ResourceARN'] for resource in routed_to(routed, medialive_decorator)]
+    if not arns:
+        return
+    channels = region_index('medialive_channels', config, build_medialive_channel_index)
+    tagged_channels = [channels[arn] for arn in arns if arn in channels]
+    pipelines = map_concurrently(lambda channel: fetch_medialive_pipeline_details(channel, config),
+                                 tagged_channels, service_limit('medialive', collector_config))
+    count_inventory('medialive', 'calls', len(tagged_channels))
+    inventory = region_inventory('medialive', config)
+    for channel, pipeline in zip(tagged_channels, pipelines):
+        inventory[channel['Arn']] = pipeline
+
+
 def medialive_decorator(resource, config):
     print(f'this resource is Medialive channel')
     arn = resource['ResourceARN']
-    client = boto3.client('medialive', config=config)
-    response = client.list_channels(
-        MaxResults=40,
-    )
-    for i in range(len(response['Channels'])):
-        if (arn == response['Channels'][i]['Arn']):
-            resource['ARN'] = response['Channels'][i]['Arn']
-            resource['id'] = response['Channels'][i]['Id']
-            response2 = client.describe_channel(
-                ChannelId = response['Channels'][i]['Id']
-                )
-            resource['Pipeline'] = response2['PipelineDetails']
+    channel = region_index('medialive_channels', config, build_medialive_channel_index).get(arn)
+    if channel is None:
+        count_inventory('medialive', 'misses')
+    else:
+        resource['ARN'] = channel['Arn']
+        resource['id'] = channel['Id']
+        pipeline = region_inventory('medialive', config).get(arn)
+        if pipeline is None:
+            count_inventory('medialive', 'fallbacks')
+            pipeline = fetch_medialive_pipeline_details(channel, config)
+        else:
+            count_inventory('medialive', 'served')
+        resource['Pipeline'] = pipeline
     return resource
 
 
 def network_monitor_decorator(resource, config):
     print(f'This resource is Network Monitor {resource["ResourceARN"]}')
     monitor_name = resource['ResourceARN'].split('/')[len(resource['ResourceARN'].split('/'))-1]
-    client = boto3.client('networkmonitor', config=config)
+    client = get_client('networkmonitor', config)
 
     result = client.get_monitor(
         monitorName=monitor_name
@@ -394,14 +919,53 @@ def odcr_decorator(resource, config):
     return resource
 
 
+def throttle_aware(config):
+    """Same config with adaptive retries. Clients created from it share a client side rate limiter
+    that slows every thread using them down as soon as the service throttles
+    """
+    return config.merge(Config(retries={'max_attempts': 10, 'mode': 'adaptive'}))
+
+
+def dynamodb_batch_stage(routed, config, collector_config):
+    """Describes all tagged tables of the region on a pool capped by the dynamodb serviceConcurrency limit.
+    Results are stored for dynamodb_decorator
+    """
+    table_names = list(dict.fromkeys(
+        resource['ResourceARN'].split('/')[-1] for resource in routed_to(routed, dynamodb_decorator)
+    ))
+    if not table_names:
+        return
+    ddb = get_client('dynamodb', throttle_aware(config))
+
+    def describe(table_name):
+        try:
+            return ddb.describe_table(TableName=table_name)['Table']
+        except ClientError as error:
+            print(f'Could not describe table {table_name}: {error}')
+            return None
+
+    print(f'Describing {len(table_names)} DynamoDB tables')
+    tables = map_concurrently(describe, table_names, service_limit('dynamodb', collector_config))
+    count_inventory('dynamodb', 'calls', len(table_names))
+    inventory = region_inventory('dynamodb', config)
+    for table_name, table in zip(table_names, tables):
+        if table is not None:
+            inventory[table_name] = table
+
+
 def dynamodb_decorator(resource, config):
     print(f'This resource is DynamoDB {resource["ResourceARN"]}')
     tablename = resource['ResourceARN'].split('/')[len(resource['ResourceARN'].split('/'))-1]
-    ddb = boto3.client('dynamodb', config=config)
-    response = ddb.describe_table(
-        TableName=tablename
-    )
-    table = response['Table']
+    table = region_inventory('dynamodb', config).get(tablename)
+    if table is None:
+        count_inventory('dynamodb', 'fallbacks')
+        ddb = get_client('dynamodb', config)
+        response = ddb.describe_table(
+            TableName=tablename
+        )
+        table = response['Table']
+    else:
+        count_inventory('dynamodb', 'served')
     billing_type = "provisioned"
     if 'BillingModeSummary' in table:
         billing_type = "ondemand"
@@ -415,131 +979,352 @@ def dynamodb_decorator(resource, config):
     return resource
 
 
+def efs_batch_stage(routed, config, collector_config):
+    """Lists the file systems of the region once and indexes them by FileSystemId for efs_decorator
+    """
+    if not routed_to(routed, efs_decorator):
+        return
+    efs = get_client('efs', config)
+    inventory = region_inventory('efs', config)
+    for page in efs.get_paginator('describe_file_systems').paginate(PaginationConfig={'PageSize': 100}):
+        count_inventory('efs', 'calls')
+        for file_system in page['FileSystems']:
+            inventory[file_system['FileSystemId']] = file_system
+
+
 def efs_decorator(resource, config):
     print(f'This resource is EFS {resource["ResourceARN"]}')
     fs_id = resource['ResourceARN'].split('/')[len(resource['ResourceARN'].split('/'))-1]
-    efs = boto3.client('efs', config=config)
-    response = efs.describe_file_systems(
-        FileSystemId=fs_id
-    )
-    
-    resource['ThroughputMode'] = response['FileSystems'][0]['ThroughputMode']
+    file_system = region_inventory('efs', config).get(fs_id)
+    if file_system is None:
+        count_inventory('efs', 'fallbacks')
+        efs = get_client('efs', config)
+        response = efs.describe_file_systems(
+            FileSystemId=fs_id
+        )
+        file_system = response['FileSystems'][0]
+    else:
+        count_inventory('efs', 'served')
+
+    resource['ThroughputMode'] = file_system['ThroughputMode']
     return resource
 
 
+def is_burstable(instance_type):
+    return 't2' in instance_type or 't3' in instance_type or 't4' in instance_type
+
+
+def ec2_batch_stage(routed, config, collector_config):
+    """Resolves instances, attached volumes and CPU credit specifications of all tagged EC2 instances
+    of the region with multi-ID calls. Results are stored for ec2_decorator
+    """
+    instance_ids = list(dict.fromkeys(
+        resource['ResourceARN'].split('/')[-1] for resource in routed_to(routed, ec2_decorator)
+    ))
+    if not instance_ids:
+        return
+
+    print(f'Resolving {len(instance_ids)} EC2 instances in batches')
+    ec2 = get_client('ec2', config)
+    instances = {}
+    for batch in chunks(instance_ids, ec2_batch_size):
+        for page in ec2.get_paginator('describe_instances').paginate(
+                Filters=[{'Name': 'instance-id', 'Values': batch}]):
+            count_inventory('ec2', 'calls')
+            for reservation in page['Reservations']:
+                for instance in reservation['Instances']:
+                    instances[instance['InstanceId']] = instance
+
+    volumes = {instance_id: [] for instance_id in instances}
+    for batch in chunks(list(instances), ec2_batch_size):
+        for page in ec2.get_paginator('describe_volumes').paginate(
+                Filters=[{'Name': 'attachment.instance-id', 'Values': batch}]):
+            count_inventory('ec2', 'calls')
+            for volume in page['Volumes']:
+                # Multi-attach volumes belong to every instance they are attached to
+                for instance_id in dict.fromkeys(attachment['InstanceId'] for attachment in volume['Attachments']):
+                    if instance_id in volumes:
+                        volumes[instance_id].append(volume)
+
+    credit_specs = {}
+    burstable_ids = [instance_id for instance_id, instance in instances.items() if is_burstable(instance['InstanceType'])]
+    for batch in chunks(burstable_ids, ec2_batch_size):
+        response = ec2.describe_instance_credit_specifications(
+            InstanceIds=batch
+        )
+        count_inventory('ec2', 'calls')
+        for credit_spec in response['InstanceCreditSpecifications']:
+            credit_specs[credit_spec['InstanceId']] = credit_spec
+
+    inventory = region_inventory('ec2', config)
+    for instance_id, instance in instances.items():
+        inventory[instance_id] = {'Volumes': volumes[instance_id], 'Instance': instance}
+        if instance_id in credit_specs:
+            inventory[instance_id]['CPUCreditSpecs'] = credit_specs[instance_id]
+
+
 def ec2_decorator(resource, config):
     print(f'This resource is EC2 {resource["ResourceARN"]}')
     instanceid = resource['ResourceARN'].split('/')[len(resource['ResourceARN'].split('/'))-1]
-    ec2 = boto3.client('ec2', config=config)
-
-    volumes = []
-
-    volume_paginator = ec2.get_paginator('describe_volumes')
-    volume_iterator = volume_paginator.paginate(
-        Filters=[
-            {
-                'Name': 'attachment.instance-id',
-                'Values': [
-                    instanceid,
-                ]
-            },
-        ]
-    )
+    ec2 = get_client('ec2', config)
 
-    for page in volume_iterator:
-        for volume in page['Volumes']:
-            volumes.append(volume)
+    batched = region_inventory('ec2', config).get(instanceid)
+    if batched:
+        count_inventory('ec2', 'served')
+        resource.update(batched)
+    else:
+        count_inventory('ec2', 'fallbacks')
+        volumes = []
+
+        volume_paginator = ec2.get_paginator('describe_volumes')
+        volume_iterator = volume_paginator.paginate(
+            Filters=[
+                {
+                    'Name': 'attachment.instance-id',
+                    'Values': [
+                        instanceid,
+                    ]
+                },
+            ]
+        )
 
-    resource['Volumes'] = volumes
+        for page in volume_iterator:
+            for volume in page['Volumes']:
+                volumes.append(volume)
 
-    response = ec2.describe_instances(
-        Filters=[
-            {
-               'Name': 'instance-id',
-               'Values': [
-                   instanceid
-               ]
-            }
-        ]
-    )
-    resource['Instance'] = response['Reservations'][0]['Instances'][0]
-    instance_type = resource['Instance']['InstanceType']
+        resource['Volumes'] = volumes
 
-    if 't2' in instance_type or 't3' in instance_type or 't4' in instance_type:
-        response = ec2.describe_instance_credit_specifications(
-            InstanceIds=[instanceid]
+        response = ec2.describe_instances(
+            Filters=[
+                {
+                   'Name': 'instance-id',
+                   'Values': [
+                       instanceid
+                   ]
+                }
+            ]
         )
-        resource['CPUCreditSpecs'] = response['InstanceCreditSpecifications'][0]
-
-    cw = boto3.client('cloudwatch', config=config)
-    results = cw.get_paginator('list_metrics')
-    for response in results.paginate(
-            MetricName='mem_used_percent',
-            Namespace='CWAgent',
-            Dimensions=[
-                {'Name': 'InstanceId', 'Value': instanceid}
-            ], ):
-        if response['Metrics']:
-            print(f'Instance {instanceid} has CWAgent')
-            resource['CWAgent'] = 'True'
-        else:
-            print(f'Instance {instanceid} does not have CWAgent')
-            resource['CWAgent'] = 'False'
+        resource['Instance'] = response['Reservations'][0]['Instances'][0]
+        instance_type = resource['Instance']['InstanceType']
+
+        if is_burstable(instance_type):
+            response = ec2.describe_instance_credit_specifications(
+                InstanceIds=[instanceid]
+            )
+            resource['CPUCreditSpecs'] = response['InstanceCreditSpecifications'][0]
+
+    if find_metrics(config, 'CWAgent', 'InstanceId', instanceid, 'mem_used_percent'):
+        print(f'Instance {instanceid} has CWAgent')
+        resource['CWAgent'] = 'True'
+    else:
+        print(f'Instance {instanceid} does not have CWAgent')
+        resource['CWAgent'] = 'False'
 
     return resource
 
 
+def elasticache_batch_stage(routed, config, collector_config):
+    """Lists the cache clusters and replication groups of the region once for elasticache_decorator.
+    Replication groups are indexed by ReplicationGroupId so all nodes of a group share one entry
+    """
+    cluster_ids = list(dict.fromkeys(
+        resource['ResourceARN'].split(':')[-1] for resource in routed_to(routed, elasticache_decorator)
+        if ':cluster:' in resource['ResourceARN']
+    ))
+    if not cluster_ids:
+        return
+    client = get_client('elasticache', config)
+    clusters = {}
+    for page in client.get_paginator('describe_cache_clusters').paginate(PaginationConfig={'PageSize': 100}):
+        count_inventory('elasticache', 'calls')
+        for cluster in page['CacheClusters']:
+            clusters[cluster['CacheClusterId']] = cluster
+
+    group_ids = list(dict.fromkeys(
+        clusters[cluster_id]['ReplicationGroupId'] for cluster_id in cluster_ids
+        if cluster_id in clusters and 'ReplicationGroupId' in clusters[cluster_id]
+    ))
+    replication_groups = {}
+    if group_ids:
+        for page in client.get_paginator('describe_replication_groups').paginate(PaginationConfig={'PageSize': 100}):
+            count_inventory('elasticache', 'calls')
+            for replication_group in page['ReplicationGroups']:
+                replication_groups[replication_group['ReplicationGroupId']] = replication_group
+
+    inventory = region_inventory('elasticache', config)
+    inventory['clusters'] = clusters
+    inventory['replicationGroups'] = replication_groups
+
+    if collector_config.get('replicationGroupFiles'):
+        for group_id in group_ids:
+            if group_id in replication_groups:
+                try:
+                    with open(f'../data/{group_id}_replicationgroup.json', "w", encoding="utf-8") as cn:
+                        cn.write(json.dumps(replication_groups[group_id], indent=4, default=str))
+                finally:
+                    cn.close()
+
+
 def elasticache_decorator(resource, config):
     print(f'This resource is Elasticache {resource["ResourceARN"]}')
     if ':cluster:' in resource['ResourceARN']:
         clusterid = resource['ResourceARN'].split(':')[len(resource['ResourceARN'].split(':'))-1]
-        client = boto3.client('elasticache', config=config)
-        response = client.describe_cache_clusters(
-            CacheClusterId=clusterid
-        )
-        resource['ClusterInfo'] = response['CacheClusters'][0]
+        inventory = region_inventory('elasticache', config)
+        client = get_client('elasticache', config)
+        if clusterid in inventory.get('clusters', {}):
+            count_inventory('elasticache', 'served')
+            resource['ClusterInfo'] = inventory['clusters'][clusterid]
+        else:
+            count_inventory('elasticache', 'fallbacks')
+            response = client.describe_cache_clusters(
+                CacheClusterId=clusterid
+            )
+            resource['ClusterInfo'] = response['CacheClusters'][0]
         if 'redis' in resource['ClusterInfo']['Engine']:
             replication_group = resource['ClusterInfo']['ReplicationGroupId']
-            response2 = client.describe_replication_groups(
-                                   ReplicationGroupId=replication_group
-                               )
-            resource['ReplicationGroup'] = response2['ReplicationGroups'][0]
-            try:
-                with open(f'../data/{resource["ClusterInfo"]["CacheClusterId"]}_replicationgroup.json', "w", encoding="utf-8") as cn:
-                    cn.write(json.dumps(resource['ReplicationGroup'], indent=4, default=str))
-            finally:
-                cn.close()
+            if replication_group in inventory.get('replicationGroups', {}):
+                resource['ReplicationGroup'] = inventory['replicationGroups'][replication_group]
+            else:
+                response2 = client.describe_replication_groups(
+                                       ReplicationGroupId=replication_group
+                                   )
+                resource['ReplicationGroup'] = response2['ReplicationGroups'][0]
 
     return resource
 
 
+def lambda_batch_stage(routed, config, collector_config):
+    """Lists the function configurations of the region when that takes fewer calls than
+    one get_function_configuration per tagged function
+    """
+    arns = [resource['ResourceARN'] for resource in routed_to(routed, lambda_decorator)]
+    if not arns:
+        return
+    lambdaclient = get_client('lambda', config)
+    function_count = lambdaclient.get_account_settings()['AccountUsage']['FunctionCount']
+    pages = math.ceil(function_count / lambda_page_size)
+    if pages >= len(arns):
+        print(f'Listing {function_count} functions would take more calls than {len(arns)} get_function_configuration calls')
+        return
+
+    # get_account_settings only counts towards the inventory when the inventory is built
+    count_inventory('lambda', 'calls')
+    inventory = region_inventory('lambda', config)
+    for page in lambdaclient.get_paginator('list_functions').paginate(
+            PaginationConfig={'PageSize': lambda_page_size}):
+        count_inventory('lambda', 'calls')
+        for function in page['Functions']:
+            inventory[function['FunctionArn']] = function
+
+
 def lambda_decorator(resource, config):
     print(f'This resource is Lambda {resource["ResourceARN"]}')
+    configuration = region_inventory('lambda', config).get(resource['ResourceARN'])
+    if configuration:
+        count_inventory('lambda', 'served')
+        resource['Configuration'] = configuration
+        return resource
+
+    count_inventory('lambda', 'fallbacks')
     functionname = resource['ResourceARN'].split(':')[len(resource['ResourceARN'].split(':')) - 1]
-    lambdaclient = boto3.client('lambda', config=config)
-    response = lambdaclient.get_function(
+    lambdaclient = get_client('lambda', config)
+    # Only the configuration, get_function also signs a code download URL and is throttled harder
+    response = lambdaclient.get_function_configuration(
         FunctionName=functionname
     )
-    resource['Configuration'] = response['Configuration']
+    del response['ResponseMetadata']
+    for field in lambda_state_fields:
+        response.pop(field, None)
+    resource['Configuration'] = response
     return resource
 
 
+def elb1_batch_stage(routed, config, collector_config):
+    """Describes the tagged classic load balancers of the region in batches of names
+    """
+    names = [resource['ResourceARN'].split('/')[-1] for resource in routed_to(routed, elb1_decorator)]
+    if not names:
+        return
+    elb = get_client('elb', config)
+    inventory = region_inventory('elb', config)
+    for batch in chunks(list(dict.fromkeys(names)), elb_batch_size):
+        count_inventory('elb', 'calls')
+        try:
+            response = elb.describe_load_balancers(
+                LoadBalancerNames=batch
+            )
+        except ClientError as e:
+            # A single missing load balancer fails the batch, elb1_decorator describes them one by one instead
+            print(f'Could not describe classic load balancers {batch} in one call: {e}')
+            continue
+        for load_balancer in response['LoadBalancerDescriptions']:
+            inventory[load_balancer['LoadBalancerName']] = load_balancer
+
+
 def elb1_decorator(resource, config):
     print(f'This resource is ELBv1 {resource["ResourceARN"]}')
     elbname = resource['ResourceARN'].split('/')[len(resource['ResourceARN'].split('/'))-1]
-    elb = boto3.client('elb', config=config)
-    response = elb.describe_load_balancers(
-       LoadBalancerNames=[
-           elbname
-        ]
-    )
-    resource['Extras'] = response['LoadBalancerDescriptions'][0]
+    load_balancer = region_inventory('elb', config).get(elbname)
+    if load_balancer is None:
+        count_inventory('elb', 'fallbacks')
+        elb = get_client('elb', config)
+        response = elb.describe_load_balancers(
+           LoadBalancerNames=[
+               elbname
+            ]
+        )
+        load_balancer = response['LoadBalancerDescriptions'][0]
+    else:
+        count_inventory('elb', 'served')
+    resource['Extras'] = load_balancer
     return resource
 
 
+def elb2_batch_stage(routed, config, collector_config):
+    """Describes the tagged application and network load balancers of the region in batches of ARNs
+    and lists the target groups of the region once, grouped by load balancer
+    """
+    arns = list(dict.fromkeys(resource['ResourceARN'] for resource in routed_to(routed, elb2_decorator)))
+    if not arns:
+        return
+    elb = get_client('elbv2', config)
+    load_balancers = {}
+    for batch in chunks(arns, elb_batch_size):
+        count_inventory('elbv2', 'calls')
+        try:
+            response = elb.describe_load_balancers(
+                LoadBalancerArns=batch
+            )
+        except ClientError as e:
+            # A single missing load balancer fails the batch, elb2_decorator describes them one by one instead
+            print(f'Could not describe load balancers {batch} in one call: {e}')
+            continue
+        for load_balancer in response['LoadBalancers']:
+            load_balancers[load_balancer['LoadBalancerArn']] = load_balancer
+
+    target_groups = {arn: [] for arn in load_balancers}
+    for page in elb.get_paginator('describe_target_groups').paginate(PaginationConfig={'PageSize': 400}):
+        count_inventory('elbv2', 'calls')
+        for target_group in page['TargetGroups']:
+            for load_balancer_arn in target_group.get('LoadBalancerArns', []):
+                if load_balancer_arn in target_groups:
+                    target_groups[load_balancer_arn].append(target_group)
+
+    inventory = region_inventory('elbv2', config)
+    for arn, load_balancer in load_balancers.items():
+        inventory[arn] = {'Extras': load_balancer, 'TargetGroups': target_groups[arn]}
+
+
 def elb2_decorator(resource, config):
     print(f'This resource is ELBv2 {resource["ResourceARN"]}')
-    elb = boto3.client('elbv2', config=config)
+    batched = region_inventory('elbv2', config).get(resource['ResourceARN'])
+    if batched:
+        count_inventory('elbv2', 'served')
+        resource.update(batched)
+        return resource
+
+    count_inventory('elbv2', 'fallbacks')
+    elb = get_client('elbv2', config)
     response = elb.describe_load_balancers(
         LoadBalancerArns=[
             resource['ResourceARN']
@@ -561,51 +1346,105 @@ def elb2_decorator(resource, config):
     return resource
 
 
-def ecs_decorator(resource, config):
-    print(f'This resource is ECS {resource["ResourceARN"]}')
-    ecs = boto3.client('ecs', config=config)
-    response = ecs.describe_clusters(
-        clusters=[
-            resource['ResourceARN']
-        ]
-    )
-    resource['cluster'] = response['clusters'][0]
-
-    services = []
-    sv_paginator = ecs.get_paginator('list_services')
-    sv_page_iterator = sv_paginator.paginate(
-        cluster=resource['ResourceARN']
-    )
-    for sv_page in sv_page_iterator:
-        services.extend(sv_page['serviceArns'])
+def ecs_service_target_groups(service):
+    if service.get('launchType') == 'EC2':
+        return [lb['targetGroupArn'] for lb in service['loadBalancers']]
+    return []
 
-    response = ecs.describe_services(
-        cluster=resource['ResourceARN'],
-        services=services
-    )
-    for service in response['services']:
-        del service['events']
-    services = response['services']
 
+def describe_ecs_services(ecs, cluster_arns, workers, counted_service=None):
+    """Services of every cluster, describe_services batches of all clusters share one pool of 'workers'.
+    The calls count as inventory calls of counted_service when it is set
+    """
+    def list_services(cluster_arn):
+        service_arns = []
+        for page in ecs.get_paginator('list_services').paginate(cluster=cluster_arn):
+            if counted_service:
+                count_inventory(counted_service, 'calls')
+            service_arns.extend(page['serviceArns'])
+        return service_arns
+
+    batches = [(cluster_arn, batch)
+               for cluster_arn, service_arns in zip(cluster_arns, map_concurrently(list_services, cluster_arns, workers))
+               for batch in chunks(service_arns, ecs_describe_services_batch_size)]
+    described_batches = map_concurrently(
+        lambda batch: ecs.describe_services(cluster=batch[0], services=batch[1])['services'], batches, workers)
+    if counted_service:
+        count_inventory(counted_service, 'calls', len(batches))
+    services = {cluster_arn: [] for cluster_arn in cluster_arns}
+    for (cluster_arn, _), described in zip(batches, described_batches):
+        for service in described:
+            del service['events']
+        services[cluster_arn].extend(described)
+    return services
+
+
+def add_ecs_instances(services, elb, workers, counted_service=None):
+    """Adds the target ids of their target groups to EC2 services. Services often share target groups,
+    every target group is looked up once. The calls count as inventory calls of counted_service when it is set
+    """
+    target_groups = list(dict.fromkeys(
+        target_group for service in services for target_group in ecs_service_target_groups(service)))
+    target_health = map_concurrently(
+        lambda target_group: elb.describe_target_health(TargetGroupArn=target_group)['TargetHealthDescriptions'],
+        target_groups, workers)
+    if counted_service:
+        count_inventory(counted_service, 'calls', len(target_groups))
+    target_ids = {target_group: [target['Target']['Id'] for target in targets]
+                  for target_group, targets in zip(target_groups, target_health)}
     for service in services:
-        target_groups = []
-        instances = []
-        if service['launchType'] == 'EC2':
-            for lb in service['loadBalancers']:
-                target_groups.append(lb['targetGroupArn'])
-
-        elb = boto3.client('elbv2', config=config)
-        for target_group in target_groups:
-            response = elb.describe_target_health(
-                TargetGroupArn=target_group
-            )
-            targets = response['TargetHealthDescriptions']
+        service['instances'] = [target_id for target_group in ecs_service_target_groups(service)
+                                for target_id in target_ids[target_group]]
 
-            for target in targets:
-                instances.append(target['Target']['Id'])
 
-        service['instances'] = instances
-    resource['services'] = services
+def ecs_batch_stage(routed, config, collector_config):
+    """Describes all tagged clusters of the region with their services and target health.
+    ECS calls run on a pool capped by the ecs serviceConcurrency limit, target health lookups on one
+    capped by the elasticloadbalancing limit. Results are stored for ecs_decorator
+    """
+    cluster_arns = list(dict.fromkeys(resource['ResourceARN'] for resource in routed_to(routed, ecs_decorator)))
+    if not cluster_arns:
+        return
+    ecs = get_client('ecs', throttle_aware(config))
+    elb = get_client('elbv2', throttle_aware(config))
+    print(f'Describing {len(cluster_arns)} ECS clusters and their services')
+    try:
+        clusters = {}
+        for batch in chunks(cluster_arns, ecs_describe_clusters_batch_size):
+            count_inventory('ecs', 'calls')
+            for cluster in ecs.describe_clusters(clusters=batch)['clusters']:
+                clusters[cluster['clusterArn']] = cluster
+        cluster_arns = [cluster_arn for cluster_arn in cluster_arns if cluster_arn in clusters]
+        services = describe_ecs_services(ecs, cluster_arns, service_limit('ecs', collector_config), 'ecs')
+        add_ecs_instances([service for cluster_arn in cluster_arns for service in services[cluster_arn]], elb,
+                          service_limit('elasticloadbalancing', collector_config), 'ecs')
+    except ClientError as error:
+        print(f'Could not describe ECS clusters, decorating them one by one: {error}')
+        return
+    inventory = region_inventory('ecs', config)
+    for cluster_arn in cluster_arns:
+        inventory[cluster_arn] = {'cluster': clusters[cluster_arn], 'services': services[cluster_arn]}
+
+
+def ecs_decorator(resource, config):
+    print(f'This resource is ECS {resource["ResourceARN"]}')
+    described = region_inventory('ecs', config).get(resource['ResourceARN'])
+    if described is None:
+        count_inventory('ecs', 'fallbacks')
+        # Runs inside the ecs share of the decoration workers, the cluster's own calls are not parallelized further
+        ecs = get_client('ecs', config)
+        response = ecs.describe_clusters(
+            clusters=[
+                resource['ResourceARN']
+            ]
+        )
+        services = describe_ecs_services(ecs, [resource['ResourceARN']], 1)[resource['ResourceARN']]
+        add_ecs_instances(services, get_client('elbv2', config), 1)
+        described = {'cluster': response['clusters'][0], 'services': services}
+    else:
+        count_inventory('ecs', 'served')
+    resource['cluster'] = described['cluster']
+    resource['services'] = described['services']
 
     return resource
 
@@ -615,54 +1454,146 @@ def natgw_decorator(resource, config):
     return resource
 
 
-def network_firewall_decorator(resource, config):
-    print(f'This resource is a Network Firewall')
-    nfw_client = boto3.client('network-firewall', config=config)
+def describe_firewall_endpoints(endpoint_ids, config, counted_service=None):
+    """Resolves VPC endpoints by ID with multi-ID calls. A filter is used instead of VpcEndpointIds
+    so a deleted endpoint does not fail the whole batch. The calls count as inventory calls of counted_service when set
+    """
+    ec2_client = get_client('ec2', config)
+    endpoints = {}
+    for batch in chunks(endpoint_ids, ec2_batch_size):
+        for page in ec2_client.get_paginator('describe_vpc_endpoints').paginate(
+                Filters=[{'Name': 'vpc-endpoint-id', 'Values': batch}]):
+            if counted_service:
+                count_inventory(counted_service, 'calls')
+            for endpoint in page['VpcEndpoints']:
+                endpoints[endpoint['VpcEndpointId']] = endpoint
+    return endpoints
+
+
+def firewall_endpoint_ids(firewall_status):
+    return [
+        sync_state['Attachment']['EndpointId']
+        for sync_state in firewall_status.get('SyncStates', {}).values()
+        if 'EndpointId' in sync_state.get('Attachment', {})
+    ]
+
+
+def enrich_firewall_endpoints(firewall_status, endpoints):
+    for sync_state in firewall_status.get('SyncStates', {}).values():
+        attachment = sync_state.get('Attachment', {})
+        endpoint = endpoints.get(attachment.get('EndpointId'))
+        if endpoint is None:
+            continue
+        attachment['ServiceName'] = endpoint['ServiceName']
+        for tag in endpoint.get('Tags', []):
+            if tag['Key'] == 'Name':
+                attachment['vpceEndpointName'] = tag['Value']
+
+
+def describe_firewall(firewall_arn, config, counted_service=None):
+    nfw_client = get_client('network-firewall', config)
+    if counted_service:
+        count_inventory(counted_service, 'calls')
     response = nfw_client.describe_firewall(
-        FirewallArn=resource['ResourceARN']
+        FirewallArn=firewall_arn
     )
-    resource['Firewall'] = response['Firewall']
-    resource['FirewallStatus'] = response['FirewallStatus']
-
-    if 'SyncStates' in resource['FirewallStatus']:
-        for az in resource['FirewallStatus']['SyncStates'].items():
-            print(f"Checking {az[1]['Attachment']['EndpointId']}")
-            vpc_endpoint_id = az[1]['Attachment']['EndpointId']
-            ec2_client = boto3.client('ec2', config=config)
-            response = ec2_client.describe_vpc_endpoints(
-                VpcEndpointIds=[
-                    vpc_endpoint_id,
-                ]
-            )
-            az[1]['Attachment']['ServiceName'] = response['VpcEndpoints'][0]['ServiceName']
-            for tag in response['VpcEndpoints'][0]['Tags']:
-                if tag['Key'] == 'Name':
-                    az[1]['Attachment']['vpceEndpointName'] = tag['Value']
-
+    firewall = {
+        'Firewall': response['Firewall'],
+        'FirewallStatus': response['FirewallStatus']
+    }
+    if counted_service:
+        count_inventory(counted_service, 'calls')
     response = nfw_client.describe_logging_configuration(
-        FirewallArn=resource['ResourceARN']
+        FirewallArn=firewall_arn
     )
+    firewall['LoggingConfiguration'] = response['LoggingConfiguration']
+    return firewall
 
-    resource['LoggingConfiguration'] = response['LoggingConfiguration']
 
-    cw_client = boto3.client('cloudwatch', config=config)
-    response = cw_client.list_metrics(
-        Namespace='AWS/NetworkFirewall',
-        Dimensions=[
-            {
-                'Name': 'FirewallName',
-                'Value': resource['ResourceARN'].split('/')[1:][0]
-            }
-        ]
+def network_firewall_batch_stage(routed, config, collector_config):
+    """Describes all tagged firewalls of the region concurrently and resolves the VPC endpoints
+    of all of them in one batched describe_vpc_endpoints pass. Results are stored for network_firewall_decorator
+    """
+    firewall_arns = list(dict.fromkeys(
+        resource['ResourceARN'] for resource in routed_to(routed, network_firewall_decorator)
+    ))
+    if not firewall_arns:
+        return
+
+    def describe(firewall_arn):
+        try:
+            return describe_firewall(firewall_arn, config, 'network-firewall')
+        except ClientError as error:
+            print(f'Could not describe firewall {firewall_arn}: {error}')
+            return None
+
+    print(f'Describing {len(firewall_arns)} network firewalls')
+    firewalls = map_concurrently(describe, firewall_arns, service_limit('network-firewall', collector_config))
+    endpoint_ids = list(dict.fromkeys(
+        endpoint_id
+        for firewall in firewalls if firewall is not None
+        for endpoint_id in firewall_endpoint_ids(firewall['FirewallStatus'])
+    ))
+    endpoints = describe_firewall_endpoints(endpoint_ids, config, 'network-firewall')
+
+    inventory = region_inventory('network-firewall', config)
+    for firewall_arn, firewall in zip(firewall_arns, firewalls):
+        if firewall is not None:
+            enrich_firewall_endpoints(firewall['FirewallStatus'], endpoints)
+            inventory[firewall_arn] = firewall
 
-    )
-    resource['Metrics'] = response['Metrics']
+
+def network_firewall_decorator(resource, config):
+    print(f'This resource is a Network Firewall')
+    firewall = region_inventory('network-firewall', config).get(resource['ResourceARN'])
+    if firewall is None:
+        count_inventory('network-firewall', 'fallbacks')
+        firewall = describe_firewall(resource['ResourceARN'], config)
+        endpoints = describe_firewall_endpoints(firewall_endpoint_ids(firewall['FirewallStatus']), config)
+        enrich_firewall_endpoints(firewall['FirewallStatus'], endpoints)
+    else:
+        count_inventory('network-firewall', 'served')
+    resource.update(firewall)
+
+    resource['Metrics'] = find_metrics(config, 'AWS/NetworkFirewall', 'FirewallName',
+                                       resource['ResourceARN'].split('/')[1:][0])
 
     return resource
 
 
 def rds_decorator(resource, config):
     print(f'This resource is RDS {resource["ResourceARN"]}')
+    instanceid = resource['ResourceARN'].split(':')[len(resource['ResourceARN'].split(':')) - 1]
+    inventory = region_inventory('rds', config)
+    if 'instances' in inventory:
+        instance = inventory['instances'].get(instanceid)
+        count_inventory('rds', 'served' if instance else 'misses')
+    else:
+        count_inventory('rds', 'fallbacks')
+        rds = get_client('rds', config)
+        try:
+            response = rds.describe_db_instances(
+                DBInstanceIdentifier=instanceid
+            )
+            instance = response['DBInstances'][0]
+        except ClientError as error:
+            print(f'Could not describe instance {instanceid}: {error}')
+            instance = None
+    if instance is None:
+        return resource
+
+    copy_fields(resource, instance, [
+        'MultiAZ', 'Engine', 'EngineVersion', 'DBInstanceClass', 'Endpoint', 'StorageType',
+        'PerformanceInsightsEnabled'
+    ])
+    if 'Iops' in instance:
+        resource['Iops'] = instance['Iops']
+    cluster = inventory.get('clusters', {}).get(instance.get('DBClusterIdentifier'))
+    if cluster:
+        resource['DBClusterIdentifier'] = instance['DBClusterIdentifier']
+        for member in cluster['DBClusterMembers']:
+            if member['DBInstanceIdentifier'] == instanceid:
+                resource['IsClusterWriter'] = member['IsClusterWriter']
     return resource
 
 
@@ -670,7 +1601,7 @@ def s3_decorator(resource, config):
     bucket_name = resource['ResourceARN'].split(':')[len(resource['ResourceARN'].split(':'))-1]
     resource['BucketName'] = bucket_name
     print(f'This resource {bucket_name} is S3 bucket')
-    s3client = boto3.client('s3', config=config)
+    s3client = get_client('s3', config)
     try:
         encryption_request = s3client.get_bucket_encryption(
             Bucket=bucket_name
@@ -697,18 +1628,81 @@ def s3_decorator(resource, config):
     return resource
 
 
+def sqs_queue_url(client, arn):
+    """Queue URL built from the account, region and name in the ARN on the endpoint of the client
+    """
+    account_id, queue_name = arn.split(':')[4], arn.split(':')[5]
+    return f'{client.meta.endpoint_url}/{account_id}/{queue_name}'
+
+
+def fetch_queue_attributes(arn, attribute_names, config, counted_service=None):
+    """Attributes of the queue, the calls count as inventory calls of counted_service when it is set
+    """
+    sqs = get_client('sqs', config)
+    if counted_service:
+        count_inventory(counted_service, 'calls')
+    try:
+        response = sqs.get_queue_attributes(
+            AttributeNames=attribute_names,
+            QueueUrl=sqs_queue_url(sqs, arn)
+        )
+    except ClientError as error:
+        if error.response.get('Error', {}).get('Code') not in sqs_missing_queue_error_codes:
+            raise
+        print(f'Derived queue URL of {arn} failed, looking it up: {error}')
+        if counted_service:
+            count_inventory(counted_service, 'calls', 2)
+        response = sqs.get_queue_url(
+            QueueName=arn.split(':')[5],
+            QueueOwnerAWSAccountId=arn.split(':')[4]
+        )
+        response = sqs.get_queue_attributes(
+            AttributeNames=attribute_names,
+            QueueUrl=response['QueueUrl']
+        )
+    return response['Attributes']
+
+
+def sqs_batch_stage(routed, config, collector_config):
+    """Fetches the configured attributes of all tagged queues of the region on a pool capped
+    by the sqs serviceConcurrency limit. The client uses adaptive retries, so its rate limiter
+    slows the pool down once SQS throttles. Results and the attribute names are stored for sqs_decorator
+    """
+    arns = list(dict.fromkeys(resource['ResourceARN'] for resource in routed_to(routed, sqs_decorator)))
+    if not arns:
+        return
+    attribute_names = collector_config.get('sqsAttributes') or sqs_attribute_names
+    inventory = region_inventory('sqs', config)
+    inventory['attributeNames'] = attribute_names
+    rate_limited = throttle_aware(config)
+
+    def fetch(arn):
+        try:
+            return fetch_queue_attributes(arn, attribute_names, rate_limited, 'sqs')
+        except ClientError as error:
+            print(f'Could not get attributes of queue {arn}: {error}')
+            return None
+
+    print(f'Fetching attributes of {len(arns)} SQS queues')
+    attributes = map_concurrently(fetch, arns, service_limit('sqs', collector_config))
+    queues = inventory.setdefault('queues', {})
+    for arn, queue_attributes in zip(arns, attributes):
+        if queue_attributes is not None:
+            queues[arn] = queue_attributes
+
+
 def sqs_decorator(resource, config):
     print(f'This resource is SQS {resource["ResourceARN"]}')
-    queue_name = resource['ResourceARN'].split(':')[len(resource['ResourceARN'].split(':'))-1]
-    sqs = boto3.client('sqs', config=config)
-    response = sqs.get_queue_url(
-        QueueName=queue_name
-    )
-    response = sqs.get_queue_attributes(
-        AttributeNames=['All'],
-        QueueUrl=response['QueueUrl']
-    )
-    resource['Attributes'] = response['Attributes']
+    inventory = region_inventory('sqs', config)
+    attributes = inventory.get('queues', {}).get(resource['ResourceARN'])
+    if attributes is None:
+        count_inventory('sqs', 'fallbacks')
+        # Same attributes as the queues of the batch stage
+        attributes = fetch_queue_attributes(resource['ResourceARN'],
+                                            inventory.get('attributeNames', sqs_attribute_names), config)
+    else:
+        count_inventory('sqs', 'served')
+    resource['Attributes'] = attributes
     return resource
 
 
@@ -724,10 +1718,38 @@ def sns_decorator(resource, config):
     return resource
 
 
+def tgw_batch_stage(routed, config, collector_config):
+    """Streams the attachments of all tagged transit gateways of the region in one paginated scan
+    and groups them by transit gateway. Attachments carry their state and association
+    """
+    tgw_ids = list(dict.fromkeys(
+        resource['ResourceARN'].split('/')[-1] for resource in routed_to(routed, tgw_decorator)
+    ))
+    if not tgw_ids:
+        return
+    tgw = get_client('ec2', config)
+    attachments = {tgw_id: [] for tgw_id in tgw_ids}
+    for batch in chunks(tgw_ids, ec2_batch_size):
+        for attachment_page in tgw.get_paginator('describe_transit_gateway_attachments').paginate(
+                Filters=[{'Name': 'transit-gateway-id', 'Values': batch}],
+                PaginationConfig={'PageSize': 1000}):
+            count_inventory('tgw', 'calls')
+            for attachment in attachment_page['TransitGatewayAttachments']:
+                attachments[attachment['TransitGatewayId']].append(attachment)
+    region_inventory('tgw', config).update(attachments)
+
+
 def tgw_decorator(resource, config):
     print(f'This resource is TGW {resource["ResourceARN"]}')
     tgwid = resource['ResourceARN'].split('/')[len(resource['ResourceARN'].split('/'))-1]
-    tgw = boto3.client('ec2', config=config)
+    batched = region_inventory('tgw', config).get(tgwid)
+    if batched is not None:
+        count_inventory('tgw', 'served')
+        resource['attachments'] = batched
+        return resource
+
+    count_inventory('tgw', 'fallbacks')
+    tgw = get_client('ec2', config)
 
     attachments = []
     attachment_paginator = tgw.get_paginator('describe_transit_gateway_attachments')
@@ -749,10 +1771,67 @@ def debug(resource):
     print(json.dumps(resource, indent=4, default=str))
 
 
-def get_config(region):
+# Decorator per (service, resource-type) of the ARN, '*' matches every resource type of the service
+decorators = {
+    ('apigateway', 'restapis'): apigw1_decorator,
+    ('apigateway', 'apis'): apigw2_decorator,
+    ('appsync', '*'): appsync_decorator,
+    ('rds', 'cluster'): aurora_decorator,
+    ('rds', 'db'): rds_decorator,
+    ('autoscaling', 'autoScalingGroup'): autoscaling_decorator,
+    ('ec2', 'capacity-reservation'): odcr_decorator,
+    ('dynamodb', 'table'): dynamodb_decorator,
+    ('ec2', 'instance'): ec2_decorator,
+    ('lambda', 'function'): lambda_decorator,
+    ('elasticloadbalancing', 'loadbalancer'): elb1_decorator,
+    ('elasticloadbalancing', 'loadbalancer/app'): elb2_decorator,
+    ('elasticloadbalancing', 'loadbalancer/net'): elb2_decorator,
+    ('ecs', 'cluster'): ecs_decorator,
+    ('ec2', 'natgateway'): natgw_decorator,
+    ('ec2', 'transit-gateway'): tgw_decorator,
+    ('sqs', '*'): sqs_decorator,
+    ('s3', '*'): s3_decorator,
+    ('sns', '*'): sns_decorator,
+    ('cloudfront', 'distribution'): cloudfront_decorator,
+    ('elasticache', '*'): elasticache_decorator,
+    ('mediapackage', 'channels'): mediapackage_decorator,
+    ('medialive', 'channel'): medialive_decorator,
+    ('elasticfilesystem', 'file-system'): efs_decorator,
+    ('elasticbeanstalk', '*'): beanstalk_decorator,
+    ('network-firewall', 'firewall'): network_firewall_decorator,
+    ('directconnect', 'dxvif'): direct_connect_handler,
+    ('networkmonitor', 'monitor'): network_monitor_decorator
+}
+
+# Resource types whose first id segment tells the kind of resource, ELBv2 'loadbalancer/app/name/id'
+subtyped_resources = {('elasticloadbalancing', 'loadbalancer')}
+
+
+# Stages that resolve a whole region's worth of one resource type before decoration
+batch_stages = [
+    ec2_batch_stage,
+    mediapackage_batch_stage,
+    medialive_batch_stage,
+    elb1_batch_stage,
+    elb2_batch_stage,
+    lambda_batch_stage,
+    tgw_batch_stage,
+    ecs_batch_stage,
+    network_firewall_batch_stage,
+    directconnect_batch_stage,
+    elasticache_batch_stage,
+    sqs_batch_stage,
+    rds_batch_stage,
+    efs_batch_stage,
+    dynamodb_batch_stage
+]
+
+
+def get_config(region, max_pool_connections=10):
     return Config(
         region_name=region,
         signature_version='s3v4',
+        max_pool_connections=max_pool_connections,
         retries={
             'max_attempts': 10,
             'mode': 'standard'
@@ -760,14 +1839,415 @@ def get_config(region):
     )
 
 
-def handler():
+def get_collector_config(main_config):
+    """Collector tuning options from the optional 'Collector' section of the main config
+    """
+    collector_config = {
+        'regionWorkers': 1,
+        'discoveryWorkers': 1,
+        'decorationWorkers': 1,
+        'serviceConcurrency': {},
+        'decorationCache': {},
+        'output': {},
+        'customNamespaces': {},
+        'accounts': {},
+        'report': {}
+    }
+    try:
+        collector_config.update(main_config['Collector'])
+    except KeyError:
+        print('No collector configuration, using defaults')
+    return collector_config
+
+
+def arn_service(resource):
+    return resource['ResourceARN'].split(':')[2]
+
+
+def service_limit(service, collector_config):
+    if service in ordered_services:
+        return 1
+    limits = collector_config['serviceConcurrency']
+    return max(1, limits.get(service, limits.get('default', collector_config['decorationWorkers'])))
+
+
+def decorate_resources(resources, routes, config, collector_config):
+    """Runs the decorator in routes of every resource on a worker pool.
+    Each AWS service gets at most its 'serviceConcurrency' share of the workers so a large group
+    of resources of one service does not trip throttling or starve the others.
+    Yields decorated resources in the same order as the input as soon as they are ready
+    """
+    workers = collector_config['decorationWorkers']
+    if workers <= 1:
+        for resource, decorator in zip(resources, routes):
+            yield decorate(resource, decorator, config)
+        return
+
+    pending = {}
+    for index, resource in enumerate(resources):
+        pending.setdefault(arn_service(resource), deque()).append(index)
+
+    decorated_resources = {}
+    next_index = 0
+    running = dict.fromkeys(pending, 0)
+    in_flight = {}
+    route = in_current_account(decorate)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending or in_flight:
+            for service in list(pending):
+                queue = pending[service]
+                limit = service_limit(service, collector_config)
+                while queue and running[service] < limit and len(in_flight) < workers:
+                    index = queue.popleft()
+                    in_flight[executor.submit(route, resources[index], routes[index], config)] = (index, service)
+                    running[service] += 1
+                if not queue:
+                    del pending[service]
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, service = in_flight.pop(future)
+                running[service] -= 1
+                decorated_resources[index] = future.result()
+
+            while next_index in decorated_resources:
+                yield decorated_resources.pop(next_index)
+                next_index += 1
+
+
+def tag_fingerprint(resource):
+    tags = sorted((tag['Key'], tag['Value']) for tag in resource.get('Tags', []))
+    return hashlib.sha256(json.dumps(tags).encode('utf-8')).hexdigest()
+
+
+def cache_ttl(service, cache_config):
+    ttls = cache_config.get('ttl', {})
+    return ttls.get(service, ttls.get('default', 86400))
+
+
+def load_decoration_cache(cache_config):
+    if not cache_config.get('enabled'):
+        return
+    try:
+        with open(cache_config.get('file', 'decoration_cache.json'), "r", encoding="utf-8") as f:
+            decoration_cache['entries'] = json.load(f)
+        print(f'Loaded {len(decoration_cache["entries"])} cached decorations')
+    except FileNotFoundError:
+        print('No decoration cache yet, decorating everything')
+
+
+def lookup_decoration_cache(resources, cache_config):
+    """Cached decoration for every resource that is neither new, retagged nor expired, None for the rest.
+    Retagged and expired entries are evicted
+    """
+    cached_resources = []
+    now = time.time()
+    with decoration_cache_lock:
+        for resource in resources:
+            cached_resource = None
+            if cache_config.get('enabled') and arn_service(resource) not in ordered_services:
+                arn = resource['ResourceARN']
+                decoration_cache['seen'].add(arn)
+                entry = decoration_cache['entries'].get(arn)
+                if entry and (entry['Fingerprint'] != tag_fingerprint(resource)
+                              or now - entry['DecoratedAt'] > cache_ttl(arn_service(resource), cache_config)):
+                    del decoration_cache['entries'][arn]
+                    decoration_cache['evicted'] += 1
+                    entry = None
+                if entry:
+                    # Discovery data is always fresh, only the decoration comes from the cache
+                    cached_resource = entry['Resource'] | resource
+                    decoration_cache['hits'] += 1
+                else:
+                    decoration_cache['misses'] += 1
+            cached_resources.append(cached_resource)
+    return cached_resources
+
+
+def store_decoration_cache(resource, cache_config):
+    if not cache_config.get('enabled') or not resource or arn_service(resource) in ordered_services \
+            or cache_ttl(arn_service(resource), cache_config) <= 0:
+        return
+    with decoration_cache_lock:
+        decoration_cache['entries'][resource['ResourceARN']] = {
+            'Fingerprint': tag_fingerprint(resource),
+            'DecoratedAt': time.time(),
+            'Resource': resource
+        }
+
+
+def save_decoration_cache(cache_config):
+    """Writes the cache without resources that were not tagged anymore in this run and reports its statistics
+    """
+    if not cache_config.get('enabled'):
+        return
+    for arn in list(decoration_cache['entries']):
+        if arn not in decoration_cache['seen']:
+            del decoration_cache['entries'][arn]
+            decoration_cache['evicted'] += 1
+    try:
+        with open(cache_config.get('file', 'decoration_cache.json'), "w", encoding="utf-8") as f:
+            f.write(json.dumps(decoration_cache['entries'], default=str))
+    finally:
+        f.close()
+    print(f'Decoration cache: {decoration_cache["hits"]} hits, {decoration_cache["misses"]} misses, '
+          f'{decoration_cache["evicted"]} evicted')
+
+
+def run_batch_stages(routed, config, collector_config):
+    for stage in batch_stages:
+        start = time.perf_counter()
+        stage(routed, config, collector_config)
+        if collection_report['enabled']:
+            record_timing('stages', stage.__name__, time.perf_counter() - start)
+
+
+def collect_region(region, tag_name, tag_values, collector_config, writer):
+    """Collects and decorates tagged resources of a single region of the current account.
+    Decorated resources are handed to the writer in discovery order as soon as they are ready,
+    except global resources, which are kept in global_resources and written once after all regions.
+    Returns the custom namespaces of the region
+    """
+    # Clients are shared by all decoration workers of the region, size their connection pools to match
+    config = get_config(region, max(10, collector_config['decorationWorkers']))
+    account = current_account.get()
+    key = region_key(region, account)
+    resources = claim_global_resources(
+        get_resources(tag_name, tag_values, config, collector_config['discoveryWorkers']), key)
+    region_namespace = {'Region': region, 'Namespaces': cw_custom_namespace_retriever(config)}
+    if account:
+        region_namespace['AccountId'] = account['Id']
+        for resource in resources:
+            resource['AccountId'] = account['Id']
+    cache_config = collector_config['decorationCache']
+    cached_resources = lookup_decoration_cache(resources, cache_config)
+    uncached_resources = [resource for resource, cached in zip(resources, cached_resources) if cached is None]
+    routes, routed = route_resources(uncached_resources)
+    try:
+        run_batch_stages(routed, config, collector_config)
+
+        fresh_resources = decorate_resources(uncached_resources, routes, config, collector_config)
+        for cached_resource in cached_resources:
+            if cached_resource is None:
+                decorated_resource = next(fresh_resources)
+                store_decoration_cache(decorated_resource, cache_config)
+            else:
+                decorated_resource = cached_resource
+            if decorated_resource and arn_service(decorated_resource) in global_services:
+                with global_resources_lock:
+                    global_resources[decorated_resource['ResourceARN']]['Resource'] = decorated_resource
+            elif decorated_resource:
+                print(f'Adding {decorated_resource["ResourceARN"]}')
+                write_resource(writer, decorated_resource, key)
+    finally:
+        release_region(region)
+    return region_namespace
+
+
+def claim_global_resources(resources, region):
+    """Drops global resources another region pass already claimed and records where each one was found
+    """
+    claimed_resources = []
+    with global_resources_lock:
+        for position, resource in enumerate(resources):
+            if arn_service(resource) in global_services:
+                entry = global_resources.get(resource['ResourceARN'])
+                if entry:
+                    entry['FoundIn'][region] = position
+                    continue
+                global_resources[resource['ResourceARN']] = {'Resource': None, 'FoundIn': {region: position}}
+            claimed_resources.append(resource)
+    return claimed_resources
+
+
+def global_order(region_keys):
+    """Decorated global resources ordered by the first region in the region_keys list that found them,
+    so the output does not depend on which region pass decorated them
+    """
+    def first_found(entry):
+        region = min(entry['FoundIn'], key=region_keys.index)
+        return region_keys.index(region), entry['FoundIn'][region]
+    entries = sorted(global_resources.values(), key=first_found)
+    return [entry['Resource'] for entry in entries if entry['Resource']]
+
+
+def collect_regions(regions, tag_name, tag_values, collector_config, writer, accounts=(None,)):
+    """Collects every region of every account with one bounded worker pool, so 'regionWorkers' is the
+    budget for all accounts together. Regions of accounts whose role cannot be assumed are skipped.
+    Namespaces are returned in account and region order regardless of completion order
+    """
+    def collect(account, region):
+        token = current_account.set(account)
+        try:
+            account_session(account, region)
+        except ClientError as error:
+            print(f'Skipping {region_key(region, account)}, could not assume role: {error}')
+            return None
+        else:
+            return collect_region(region, tag_name, tag_values, collector_config, writer)
+        finally:
+            current_account.reset(token)
+
+    passes = [(account, region) for account in accounts for region in regions]
+    region_workers = collector_config['regionWorkers']
+    if region_workers <= 1 or len(passes) <= 1:
+        region_namespaces = [collect(account, region) for account, region in passes]
+    else:
+        with ThreadPoolExecutor(max_workers=region_workers) as executor:
+            region_namespaces = list(executor.map(lambda collection_pass: collect(*collection_pass), passes))
+    return [region_namespace for region_namespace in region_namespaces if region_namespace is not None]
+
+
+def region_order(resources, regions):
+    """Orders resources by account and the position of their region in the regions list.
+    Sort is stable so discovery order within a region is kept
+    """
+    return sorted(resources, key=lambda resource: (resource['ResourceARN'].split(':')[4],
+                                                   regions.index(resource['ResourceARN'].split(':')[3])))
+
+
+def get_accounts(account_config):
+    """Accounts to collect, [None] collects the account of the credentials of the run.
+    In multi-account mode these are the configured account ids or, without ids, the active accounts of the organization.
+    Roles are only assumed in other accounts than the one of the run
+    """
+    if not account_config.get('enabled'):
+        return [None]
+    role_name = account_config.get('roleName')
+    if not role_name:
+        # No default, the role every organization account has is OrganizationAccountAccessRole with admin access
+        print('Collector.accounts.roleName must name a read-only role when Collector.accounts.enabled is set')
+        quit()
+    account_ids = account_config.get('ids')
+    if not account_ids:
+        organizations = get_client('organizations', get_config('us-east-1'))
+        account_ids = [account['Id'] for page in organizations.get_paginator('list_accounts').paginate()
+                       for account in page['Accounts'] if account['Status'] == 'ACTIVE']
+        print(f'Found {len(account_ids)} active accounts in the organization')
+    own_account_id = get_client('sts', get_config('us-east-1')).get_caller_identity()['Account']
+    return [{'Id': account_id, 'RoleName': None if account_id == own_account_id else role_name}
+            for account_id in account_ids]
+
+
+def open_resource_writer(output_file, output_config, regions):
+    """Writer for decorated resources.
+    'json' format keeps the classic indented document and writes it on close in region order.
+    'ndjson' format streams one compact line per resource to a part file per output file and region pass,
+    optionally sharded per region and service. On close the parts of every output file are joined in region
+    order, optionally gzip compressed, so the output does not depend on which region finished first.
+    A manifest records the record count and size of every output file
+    """
+    return {
+        'format': output_config.get('format', 'json'),
+        'compress': output_config.get('compress', False),
+        'shard': output_config.get('shard', False),
+        'lineOffsets': output_config.get('lineOffsets', False),
+        'output_file': output_file,
+        'base': os.path.splitext(output_file)[0],
+        'regions': regions,
+        'buckets': {},
+        'parts': {},
+        'lock': threading.Lock()
+    }
+
+
+def shard_file(writer, region, service):
+    suffix = '.ndjson.gz' if writer['compress'] else '.ndjson'
+    if writer['shard']:
+        return os.path.join(writer['base'], region, service + suffix)
+    return writer['base'] + suffix
+
+
+def open_part(writer, key, region):
+    """Part file of the output file 'key' for the lines of one region pass, None for resources written after all regions
+    """
+    position = writer['regions'].index(region) if region in writer['regions'] else len(writer['regions'])
+    path = f'{shard_file(writer, *key)}.{position}.part'
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    part = {'file': path, 'handle': open(path, 'wb')}
+    writer['parts'][(key, region)] = part
+    return part
+
+
+def write_resource(writer, resource, region=None):
+    with writer['lock']:
+        if writer['format'] == 'json':
+            writer['buckets'].setdefault(region, []).append(resource)
+            return
+
+        key = (None, None)
+        if writer['shard']:
+            key = (resource['ResourceARN'].split(':')[3] or 'global', arn_service(resource))
+        part = writer['parts'].get((key, region)) or open_part(writer, key, region)
+        part['handle'].write((json.dumps(resource, default=str, separators=(',', ':')) + '\n').encode('utf-8'))
+
+
+def join_parts(writer, key):
+    """Joins the parts of an output file in region order and returns its manifest entry
+    """
+    path = shard_file(writer, *key)
+    shard = {'file': path, 'region': key[0], 'service': key[1], 'count': 0, 'bytes': 0}
+    if writer['lineOffsets']:
+        shard['offsets'] = []
+    with (gzip.open(path, 'wb') if writer['compress'] else open(path, 'wb')) as output:
+        for region in writer['regions'] + [None]:
+            part = writer['parts'].get((key, region))
+            if part is None:
+                continue
+            with open(part['file'], 'rb') as lines:
+                for line in lines:
+                    output.write(line)
+                    if writer['lineOffsets']:
+                        shard['offsets'].append(shard['bytes'])
+                    shard['bytes'] += len(line)
+                    shard['count'] += 1
+            os.remove(part['file'])
+    return shard
+
+
+def close_resource_writer(writer):
+    if writer['format'] == 'json':
+        decorated_resources = []
+        for region in writer['regions'] + [None]:
+            decorated_resources.extend(writer['buckets'].get(region, []))
+        try:
+            with open(writer['output_file'], "w", encoding="utf-8") as n:
+                n.write(json.dumps(decorated_resources, indent=4, default=str))
+        finally:
+            n.close()
+        return
+
+    manifest = {'format': 'ndjson', 'compressed': writer['compress'], 'count': 0, 'shards': []}
+    manifest_file = os.path.join(writer['base'], 'manifest.json') if writer['shard'] \
+        else writer['base'] + '.manifest.json'
+    for part in writer['parts'].values():
+        part['handle'].close()
+    for key in sorted({key for key, _ in writer['parts']}, key=str):
+        shard = join_parts(writer, key)
+        # Shard paths are relative to the manifest, so the CDK app finds them from any working directory
+        shard['file'] = os.path.relpath(shard['file'], os.path.dirname(manifest_file) or '.')
+        manifest['count'] += shard['count']
+        manifest['shards'].append(shard)
+    # The CDK app reads the manifest in ndjson mode, a ResourceFile left from a json run must not be deployed instead
+    if os.path.exists(writer['output_file']):
+        os.remove(writer['output_file'])
+        print(f'Removed {writer["output_file"]} of an earlier json run')
+    try:
+        with open(manifest_file, "w", encoding="utf-8") as m:
+            m.write(json.dumps(manifest))
+    finally:
+        m.close()
+    print(f'Wrote {manifest["count"]} resources in {len(manifest["shards"])} files, manifest {manifest_file}')
+
+
+def handler(config_file="../lib/config.json"):
     tag_name = 'iem'
     tag_values = ['202202', '202102']
     regions = ['eu-west-1', 'eu-north-1']
     output_file = "resources.json"
     custom_namespace_file = "custom_namespaces.json"
     try:
-        with open("../lib/config.json", "r", encoding="utf-8") as f:
+        with open(config_file, "r", encoding="utf-8") as f:
             main_config = json.load(f)
     except FileNotFoundError:
         print("Could not find config file!!! You should run this from 'data' directory!")
@@ -803,25 +2283,34 @@ def handler():
     except:
         print('No custom namespaces configured')
 
-    decorated_resources = []
+    collector_config = get_collector_config(main_config)
+    start = time.perf_counter()
+    start_collection_report(collector_config['report'])
+    load_decoration_cache(collector_config['decorationCache'])
+    load_namespace_cache(collector_config['customNamespaces'])
+
     region_namespaces = {'RegionNamespaces': []}
     if 'us-east-1' not in regions:
         regions.append('us-east-1')
         print('Added us-east-1 region for global services')
 
-    for region in regions:
-        config = get_config(region)
-        resources = get_resources(tag_name, tag_values, config)
-        region_namespace = {'Region': region, 'Namespaces' : cw_custom_namespace_retriever(config) }
-        region_namespaces['RegionNamespaces'].append(region_namespace)
-        for resource in resources:
-            decorated_resource = router(resource, config)
-            if decorated_resource:
-                print(f'Adding {decorated_resource["ResourceARN"]}')
-                decorated_resources.append(decorated_resource)
-
-    decorated_resources.extend(direct_connects)
-    decorated_resources.extend(direct_connect_vifs)
+    accounts = get_accounts(collector_config['accounts'])
+    region_keys = [region_key(region, account) for account in accounts for region in regions]
+    writer = open_resource_writer(output_file, collector_config['output'], region_keys)
+    region_namespaces['RegionNamespaces'].extend(
+        collect_regions(regions, tag_name, tag_values, collector_config, writer, accounts))
+
+    for resource in global_order(region_keys):
+        print(f'Adding {resource["ResourceARN"]}')
+        write_resource(writer, resource)
+    for resource in region_order(list(direct_connects.values()), regions) + region_order(list(direct_connect_vifs.values()), regions):
+        write_resource(writer, resource)
+    close_resource_writer(writer)
+    print(f'Created {client_pool_stats["created"]} API clients, reused them {client_pool_stats["reused"]} times')
+    print_inventory_stats()
+    save_decoration_cache(collector_config['decorationCache'])
+    save_namespace_cache()
+    save_collection_report(collector_config['report'], time.perf_counter() - start)
 
     try:
         with open(custom_namespace_file, "w", encoding="utf-8") as cn:
@@ -829,12 +2318,6 @@ def handler():
     finally:
         cn.close()
 
-    try:
-        with open(output_file, "w", encoding="utf-8") as n:
-            n.write(json.dumps(decorated_resources, indent=4, default=str))
-    finally:
-        n.close()
-
 
 if __name__ == '__main__':
     handler()
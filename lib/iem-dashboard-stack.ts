@@ -2,17 +2,57 @@ import {Stack,StackProps} from 'aws-cdk-lib';
 import {Construct} from 'constructs'
 import {GraphFactory} from "./services/graphfactory";
 import {Dashboard} from "aws-cdk-lib/aws-cloudwatch";
+import * as fs from 'fs';
+import * as path from 'path';
+import * as zlib from 'zlib';
 
 const config = require('./config.json');
 
+/***
+ * Loads the resources written by resource_collector.py with Collector.output.format 'ndjson'. Only the shards of the
+ * configured regions and global resources are read, in the order of the Regions list, so shards of regions that are
+ * no longer configured are skipped.
+ ***/
+function loadNdjsonResources(output:any):any[] {
+  const base = path.join(__dirname, config.ResourceFile.replace(/\.[^./]*$/, ''));
+  const manifestFile = output.shard ? path.join(base, 'manifest.json') : base + '.manifest.json';
+  const manifest = JSON.parse(fs.readFileSync(manifestFile, 'utf-8'));
+  // The collector always adds us-east-1 for global services
+  const regions:string[] = (config.Regions || []).concat(['us-east-1', 'global']);
+  let shards = manifest.shards;
+  if ( output.shard ){
+    shards = shards.filter((shard:any) => regions.indexOf(shard.region) > -1);
+    shards.sort((a:any, b:any) => regions.indexOf(a.region) - regions.indexOf(b.region));
+  }
+  let resources:any[] = [];
+  for ( const shard of shards ){
+    let data = fs.readFileSync(path.join(path.dirname(manifestFile), shard.file));
+    if ( manifest.compressed ){
+      data = zlib.gunzipSync(data);
+    }
+    for ( const line of data.toString('utf-8').split('\n') ){
+      if ( line ){
+        resources.push(JSON.parse(line));
+      }
+    }
+  }
+  console.log(`LOADED ${resources.length} RESOURCES FROM ${shards.length} OF ${manifest.shards.length} SHARDS IN ${manifestFile}`);
+  return resources;
+}
+
 export class IemDashboardStack extends Stack {
   constructor(scope: Construct, id: string, props?: StackProps) {
     super(scope, id, props);
 
     let resources:any = [];
+    const output = (config.Collector && config.Collector.output) || {};
     try {
-      resources = require(config.ResourceFile);
-      console.log(`LOADED RESOURCE FILE ${config.ResourceFile}`);
+      if ( output.format === 'ndjson' ){
+        resources = loadNdjsonResources(output);
+      } else {
+        resources = require(config.ResourceFile);
+        console.log(`LOADED RESOURCE FILE ${config.ResourceFile}`);
+      }
     } catch {
       console.log(`ERROR: ${config.ResourceFile} not found, run 'cd data; python resource_collector.py'`);
     }